@@ -1,7 +1,14 @@
+from collections import deque, OrderedDict
+import math
+
 import pygame
 from pygame.locals import *
 from pygame import Color
 
+from atlas import Atlas, isAtlas
+from surfaceformat import indexedSurface, scaleSurface, surfaceBytes, addPaletteOption, FormatStats, OPAQUE, PALETTE
+from profiler import FrameProfiler
+
 """
     Animator 
     
@@ -35,94 +42,583 @@ __version__ = "0.2"
 # La résolution du programme
 RESOLUTION = (400,300)
 
+# Délai minimum entre deux vérifications du dossier des images, en secondes
+CHECK_INTERVAL = 0.25
+
+# Temps maximum passé à intégrer les images chargées à chaque affichage, en secondes
+LOAD_BUDGET = 0.004
+
+# Vitesse de l'animation par défaut, en frames par seconde
+ANIM_RATE = 12
+
+# Vitesse la plus lente atteinte en la diminuant au clavier, en frames par seconde
+MIN_ANIM_RATE = 0.125
+
+# Nombre maximum d'affichages par seconde, 0 = sans limite
+RENDER_FPS = 60
+
+# Fichier donnant la durée de chaque frame en millisecondes, dans le dossier des images
+DURATIONS_FILE = "durations.json"
+
+# Mémoire maximum des images agrandies gardées pour les différentes tailles, en octets
+SCALED_BUDGET = 64 * 1024 * 1024
+
+def scaleImage(image, scale):
+    """ Redimensionne une image en gardant ses proportions """
+    if scale > 1:
+        width = image.get_width() * scale
+        height = image.get_height() * scale
+        image = scaleSurface(image, (width, height))
+    return image
+
+class FrameLoader:
+    """ 
+        La classe FrameLoader décode les images dans des threads, en dehors de la
+        boucle d'affichage. Les images décodées sont récupérées par la boucle 
+        d'affichage depuis une file d'attente (queue).
+    """
+    def __init__(self, workers = 4):
+        from concurrent.futures import ThreadPoolExecutor
+        import queue
+        # Le décodage des PNG par pygame libère le GIL: les threads travaillent en parallèle
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        # Les images décodées: (fichier, signature, image ou None si illisible,
+        # image en palette ou None si elle n'a pas été demandée ou a trop de couleurs)
+        self.results = queue.Queue()
+
+    def submit(self, filename, signature, palette = False):
+        """ Demande le chargement d'une image, et son passage en palette si palette """
+        self.executor.submit(self.decode, filename, signature, palette)
+
+    def decode(self, filename, signature, palette = False):
+        """ Exécuté dans un thread: charge l'image et compte ses couleurs, ce qui est long """
+        image = indexed = None
+        try:
+            image = pygame.image.load(filename)
+            if palette:
+                indexed = indexedSurface(image)
+        except (pygame.error, IOError, OSError): # L'image est illisible
+            pass
+        finally: # Même illisible, on doit prévenir que le chargement est fini
+            self.results.put((filename, signature, image, indexed))
+
+    def ready(self):
+        """ Retourne les images décodées depuis le dernier appel, sans attendre """
+        import queue
+        while True:
+            try:
+                yield self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def shutdown(self):
+        """ Arrête les threads, les chargements en attente sont abandonnés """
+        self.executor.shutdown(wait = False, cancel_futures = True)
+
+class FrameSet:
+    """ 
+        La classe FrameSet représente les frames d'une animation, lues depuis 
+        un dossier et rechargées seulement quand leur fichier a changé 
+        Les frames peuvent aussi être lues depuis un atlas (voir atlas.py)
+        Chaque image n'est décodée qu'une fois, à sa taille d'origine: les images
+        agrandies en sont faites à la demande et gardées, pour chaque taille, 
+        tant qu'elles tiennent dans scaled_budget octets.
+    """
+    def __init__(self, path, scale = 1, check_interval = CHECK_INTERVAL, loader = None, 
+            scaled_budget = SCALED_BUDGET, palette = False):
+        # Dossier ou sont stockées les images
+        self.path = path
+        # Si il y en a un, les images sont chargées en arrière plan par le loader
+        self.loader = loader
+        # Fichiers en cours de chargement et leur signature
+        self.loading = {}
+        # Taille d'affichage des images
+        self.scale = scale
+        # Délai entre deux vérifications du dossier
+        self.check_interval = check_interval
+        # Pour chaque fichier vu dans le dossier: (taille, date de modification)
+        self.files = {}
+        # Fichiers chargés, triés par ordre alphabétique ...
+        self.names = []
+        # ... et les images correspondantes, à leur taille d'origine, dans le même ordre
+        self.images = []
+        # Images agrandies: (fichier, taille) -> image, les moins récemment utilisées d'abord
+        self.scaled = OrderedDict()
+        self.scaled_size = 0
+        self.scaled_budget = scaled_budget
+        # Les images d'au plus 256 couleurs sont passées en palette si palette:
+        # 4 fois moins de mémoire, mais elles sont plus lentes à afficher
+        self.palette = palette
+        # Mémoire gagnée par le format choisi pour chaque image
+        self.formats = FormatStats()
+        # Date de modification du dossier lors de la dernière lecture
+        self.dir_mtime = None
+        # Date de la dernière vérification
+        self.last_check = 0
+        # Si le chemin est le manifeste d'un atlas, les frames sont lues dans ses feuilles
+        self.atlas = Atlas(path) if isAtlas(path) else None
+
+    def setScale(self, scale):
+        """ Change la taille des images: rien n'est relu, les images agrandies sont faites à la demande """
+        self.scale = scale
+
+    def image(self, n, scale = None):
+        """ Image de la frame n, agrandie à la taille demandée (par défaut celle de setScale) """
+        if scale is None:
+            scale = self.scale
+        if scale <= 1:
+            return self.images[n]
+        key = (self.names[n], scale)
+        image = self.scaled.get(key)
+        if image is None:
+            image = scaleImage(self.images[n], scale)
+            # Si elle ne tient pas, elle sera agrandie à nouveau à chaque affichage, comme en mode natif
+            if self.makeRoom(scale, surfaceBytes(image)):
+                self.scaled[key] = image
+                self.scaled_size += surfaceBytes(image)
+        else:
+            self.scaled.move_to_end(key)
+        return image
+
+    def makeRoom(self, scale, size):
+        """ 
+            Oublie les images agrandies à d'autres tailles, les moins récemment utilisées
+            d'abord, jusqu'à avoir la place de size octets de plus
+            Retourne False si il n'y a pas la place même ainsi: les frames à la taille
+            demandée ne sont jamais oubliées, sinon une animation qui ne tient pas
+            dans le budget agrandirait chaque frame à nouveau à chaque affichage
+        """
+        for key in [key for key in self.scaled if key[1] != scale]:
+            if self.scaled_size + size <= self.scaled_budget:
+                break
+            self.scaled_size -= surfaceBytes(self.scaled.pop(key))
+        return self.scaled_size + size <= self.scaled_budget
+
+    def prepare(self, budget = LOAD_BUDGET):
+        """ 
+            Agrandit les frames qui ne le sont pas encore à la taille actuelle, 
+            pendant au plus budget secondes
+            S'arrête quand scaled_budget est atteint: les frames suivantes seront
+            agrandies au moment de les afficher
+        """
+        import time
+        if self.scale <= 1:
+            return
+        start = time.time()
+        for n, name in enumerate(self.names):
+            if not (name, self.scale) in self.scaled:
+                image = self.images[n]
+                size = image.get_bytesize() * image.get_width() * image.get_height() * self.scale ** 2
+                if not self.makeRoom(self.scale, size):
+                    break
+                self.image(n)
+                if time.time() - start > budget:
+                    break # La suite sera faite au prochain affichage
+
+    def forgetScaled(self, filename):
+        """ Oublie les images agrandies d'un fichier qui a changé """
+        for key in [key for key in self.scaled if key[0] == filename]:
+            self.scaled_size -= surfaceBytes(self.scaled.pop(key))
+
+    def listFiles(self):
+        """ Liste les images présentes dans le dossier """
+        import os
+        try:
+            return [os.path.join(self.path, filename) for filename in os.listdir(self.path) 
+                if filename.lower().endswith(".png")]
+        except OSError: # Le dossier n'existe pas (ou plus)
+            return []
+
+    def reload(self, force = False):
+        """ 
+            Recharge les images ajoutées ou modifiées et oublie celles qui ont été
+            supprimées. Retourne True si les frames ont changé.
+        """
+        import os
+        import time
+        now = time.time()
+        if not force and now - self.last_check < self.check_interval:
+            return False # On a vérifié il y a très peu de temps
+        self.last_check = now
+        if self.atlas is not None:
+            return self.reloadAtlas()
+
+        # On ne relit le contenu du dossier que si des fichiers y ont été ajoutés ou supprimés
+        try:
+            dir_mtime = os.path.getmtime(self.path)
+        except OSError:
+            dir_mtime = None
+        if dir_mtime != self.dir_mtime or dir_mtime is None:
+            self.dir_mtime = dir_mtime
+            filenames = self.listFiles()
+        else:
+            filenames = list(self.files)
+
+        changed = False
+        for filename in set(self.files) - set(filenames):
+            self.remove(filename) # Le fichier a été supprimé
+            changed = True
+        for filename in sorted(filenames): # Les premières frames sont chargées en premier
+            # Un fichier modifié change de taille ou de date de modification
+            try:
+                stat = os.stat(filename)
+            except OSError: # Supprimé entre temps
+                self.remove(filename)
+                changed = True
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if self.files.get(filename) != signature:
+                self.files[filename] = signature
+                if self.loader is None:
+                    self.update(filename, self.load(filename))
+                    changed = True
+                else: # L'image sera ajoutée par collect une fois chargée
+                    self.loading[filename] = signature
+                    self.loader.submit(filename, signature, self.palette)
+        return changed
+
+    def reloadAtlas(self):
+        """ Relit toutes les frames depuis l'atlas, si il a été reconstruit """
+        if not self.atlas.poll() and self.dir_mtime == self.atlas.mtime:
+            return False
+        self.dir_mtime = self.atlas.mtime
+        # Les frames sont dans l'ordre alphabétique de leur fichier d'origine
+        names = sorted(self.atlas.names, key = lambda name: self.atlas.sprites[name]["path"])
+        self.files = dict((name, (None, self.atlas.mtime)) for name in names)
+        self.loading.clear()
+        self.scaled.clear()
+        self.scaled_size = 0
+        self.names[:] = names
+        # Une seule image décodée par feuille: les frames en sont des morceaux
+        self.images[:] = [self.optimize(self.atlas.loadImage(name)) for name in names]
+        return True
+
+    def collect(self, budget = LOAD_BUDGET):
+        """ 
+            Ajoute les images chargées en arrière plan, pendant au plus budget secondes
+            Retourne True si les frames ont changé.
+        """
+        import time
+        if self.loader is None or not self.loading:
+            return False
+        start = time.time()
+        changed = False
+        for filename, signature, image, indexed in self.loader.ready():
+            # Le fichier a pu changer pendant le chargement: le résultat est périmé
+            if self.loading.get(filename) == signature:
+                del self.loading[filename]
+                if image is not None:
+                    image = self.display(image, indexed)
+                self.update(filename, image)
+                changed = True
+            if time.time() - start > budget:
+                break # La suite sera ajoutée au prochain affichage
+        return changed
+
+    def progress(self):
+        """ Nombre d'images chargées et nombre total d'images """
+        return len(self.files) - len(self.loading), len(self.files)
+
+    def load(self, filename):
+        """ Charge une image depuis le disque, retourne None si elle est illisible """
+        try: # Utilisé pour gérer les erreurs (appellées "exceptions")
+            image = pygame.image.load(filename) # On la charge depuis le disque
+        except (pygame.error, IOError, OSError): # L'image est illisible (en cours d'écriture ...)
+            return None
+        return self.optimize(image)
+
+    def optimize(self, image):
+        """ Prépare une image décodée pour l'affichage, en palette si demandé """
+        return self.display(image, indexedSurface(image) if self.palette else None)
+
+    def display(self, image, indexed):
+        """ 
+            Retourne l'image en palette si il y en a une: 4 fois moins de mémoire,
+            sinon l'image convertie au format de l'écran (doit être fait par le thread d'affichage)
+        """
+        if indexed is None:
+            image = image.convert()
+            self.formats.add(OPAQUE, image, image)
+            return image
+        self.formats.add(PALETTE, image, indexed)
+        return indexed
+
+    def update(self, filename, image):
+        """ Remplace (ou ajoute) l'image d'un fichier en gardant l'ordre alphabétique """
+        from bisect import bisect_left
+        n = bisect_left(self.names, filename)
+        present = n < len(self.names) and self.names[n] == filename
+        if present: # Les images agrandies de l'ancienne version sont périmées
+            self.forgetScaled(filename)
+        if image is None:
+            if present: # L'image n'est plus lisible: on la retire
+                del self.names[n]
+                del self.images[n]
+        elif present:
+            self.images[n] = image
+        else:
+            self.names.insert(n, filename)
+            self.images.insert(n, image)
+
+    def remove(self, filename):
+        """ Oublie un fichier supprimé """
+        self.files.pop(filename, None)
+        self.loading.pop(filename, None)
+        self.update(filename, None)
+
+class Playback:
+    """
+        La classe Playback choisit la frame à afficher d'après le temps écoulé,
+        et non d'après le nombre d'affichages: l'animation garde sa vitesse même
+        quand l'affichage ralentit, quitte à sauter des frames.
+        Chaque frame dure 1/rate secondes, sauf si le fichier des durées en 
+        donne une autre: {"frame.png": millisecondes, ...}
+    """
+    def __init__(self, rate = ANIM_RATE, durations_file = None, check_interval = CHECK_INTERVAL):
+        # Frames par seconde, quand la frame n'a pas de durée à elle
+        self.setRate(rate)
+        # Durées en millisecondes, par nom de fichier, et date de modification du fichier des durées
+        self.durations_file = durations_file
+        self.durations = {}
+        self.durations_mtime = None
+        self.check_interval = check_interval
+        self.last_check = 0
+        # Frame affichée et temps passé dessus
+        self.frame = 0
+        self.frame_time = 0
+        self.last_update = None
+        # Nombre de frames sautées parce que l'affichage était en retard
+        self.skipped = 0
+        # Moments ou une nouvelle frame a été affichée, pendant la dernière seconde
+        self.shown = deque()
+
+    def setRate(self, rate):
+        """ Change la vitesse, qui doit être positive: une vitesse nulle ou négative bloquerait update """
+        if not rate > 0 or math.isinf(rate):
+            raise ValueError("{0} is not a positive animation rate".format(rate))
+        self.rate = rate
+
+    def faster(self):
+        """ Une frame par seconde de plus, ou deux fois plus vite sous deux frames par seconde """
+        self.setRate(self.rate + 1 if self.rate >= 2 else self.rate * 2)
+
+    def slower(self):
+        """ Une frame par seconde de moins, ou deux fois moins vite sous deux, jusqu'à MIN_ANIM_RATE """
+        self.setRate(max(MIN_ANIM_RATE, self.rate - 1 if self.rate > 2 else self.rate / 2))
+
+    def duration(self, filename):
+        """ Durée d'une frame, en secondes """
+        import os
+        ms = self.durations.get(os.path.basename(filename))
+        if ms is None or ms <= 0:
+            return 1 / self.rate
+        return ms / 1000
+
+    def checkDurations(self):
+        """ Relit le fichier des durées si il a changé """
+        import os
+        import time
+        now = time.time()
+        if self.durations_file is None or now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        try:
+            mtime = os.path.getmtime(self.durations_file)
+        except OSError: # Pas (ou plus) de fichier: toutes les frames ont la même durée
+            self.durations = {}
+            self.durations_mtime = None
+            return
+        if mtime != self.durations_mtime:
+            import json
+            try:
+                with open(self.durations_file, "r") as f:
+                    self.durations = dict(json.load(f))
+                self.durations_mtime = mtime
+            except (IOError, ValueError, TypeError) as e: # En cours d'écriture ...
+                print("{0}: {1}".format(self.durations_file, e))
+
+    def update(self, names, now = None):
+        """ 
+            Avance l'animation du temps écoulé depuis le dernier appel
+            Retourne le numéro de la frame à afficher, ou None si il n'y en a pas
+        """
+        import time
+        if now is None:
+            now = time.perf_counter()
+        elapsed = 0 if self.last_update is None else now - self.last_update
+        self.last_update = now
+        while self.shown and now - self.shown[0] > 1:
+            self.shown.popleft()
+        if not names:
+            return None
+        if self.frame >= len(names): # Des frames ont été supprimées
+            self.frame = 0
+            self.frame_time = 0
+
+        self.frame_time += elapsed
+        advanced = 0
+        duration = self.duration(names[self.frame])
+        while self.frame_time >= duration:
+            self.frame_time -= duration
+            self.frame = (self.frame + 1) % len(names)
+            advanced += 1
+            if advanced == len(names):
+                # Après un long arrêt, inutile de parcourir l'animation plusieurs fois
+                self.frame_time %= sum(self.duration(name) for name in names)
+            duration = self.duration(names[self.frame])
+        if advanced:
+            self.shown.append(now)
+            self.skipped += min(advanced, len(names)) - 1
+        return self.frame
+
+    def animFps(self):
+        """ Nombre de frames différentes affichées pendant la dernière seconde """
+        return len(self.shown)
+
 class Animator:
     """ La classe Animator représente le programme "Animator" """
-    def __init__(self, resolution, images_path):
+    def __init__(self, resolution, images_path, trace_file = None, rate = ANIM_RATE, 
+            durations_file = None, render_fps = RENDER_FPS, vsync = False, native = False, palette = False):
         """ 
             Lancé quand un objet de la classe Animator est créé (c'est à dire 
             qu'on lance le programme) 
+            Avec trace_file, le temps passé dans chaque étape de l'affichage y est enregistré
+            L'animation joue rate frames par seconde, ou suit les durées de durations_file,
+            quelle que soit la vitesse de l'affichage: render_fps images par seconde au 
+            plus (0 = sans limite), ou au rythme de l'écran avec vsync
+            Avec native, les frames ne sont pas gardées agrandies: la frame affichée
+            est agrandie à chaque affichage
+            Avec palette, les frames d'au plus 256 couleurs sont gardées en 8 bits
         """
-        # Créée un objet "Clock" pour pouvoir afficher à 60 images/sec
+        # Créée un objet "Clock" pour mesurer (et limiter) la vitesse d'affichage
         self.clock_fps = pygame.time.Clock()
-        # Vitesse d'affichage: 0 = 60 images/secondes, 1 = 30 images/secondes, 2 = 15 images par secondes
-        # Attention: plus c'est haut plus c'est lent !
-        self.speed = 4
-        # Compteur pour garder la trace de ou on est dans l'animation
-        self.anim_count = 0
+        self.render_fps = render_fps
+        self.vsync = vsync
+        # Par défaut le fichier des durées est dans le dossier des images
+        if durations_file is None:
+            import os
+            durations_file = os.path.join(images_path if os.path.isdir(images_path) 
+                else os.path.dirname(images_path), DURATIONS_FILE)
+        # Choisit la frame à afficher d'après le temps écoulé
+        self.playback = Playback(rate, durations_file)
         # Par défaut on garde la taille de l'image
         self.scale = 1
-        # Frames de l'animation, triées par ordre alphabétique
-        self.images = []
+        # Agrandit la frame au moment de l'afficher plutôt que de garder les frames agrandies
+        self.native = native
         # Dossier ou sont stockées les images
         self.images_path = images_path
+        # Les images sont décodées en arrière plan pour ne pas bloquer l'affichage
+        self.loader = FrameLoader()
+        # Frames de l'animation, triées par ordre alphabétique
+        self.frames = FrameSet(images_path, self.scale, loader = self.loader, palette = palette)
+        self.images = self.frames.images
+        # Mesure le temps passé dans chaque étape de l'affichage, affiché avec F3
+        self.profiler = FrameProfiler(trace_file)
         # Police de caractères pour la barre de statut 
         self.status_bar_font = pygame.font.SysFont("arial", 12)
         # Créée la zone d'affichage redimensionnable 
         # et la conserve en mémoire pour dessiner dessus plus tard
-        self.screen = pygame.display.set_mode(resolution, pygame.RESIZABLE)
+        self.screen = self.setMode(resolution)
         # On affiche les paramètres du programme
         self.displayParameters()
 
         # On boucle tant qu'on n'a pas quitté
         self.quit = False
         while not self.quit:
+            self.profiler.beginFrame()
             # On traite chaque évènement (event) qui se produit
-            for event in pygame.event.get():
-                if event.type == QUIT: # L'évènement est de quitter
-                    self.quit = True
-                    break # On ne traite pas d'évènements supplémentaires
-                elif event.type == VIDEORESIZE: # Redimensionnement de la fenetre
-                    # On met la fenetre à la nouvelle taille
-                    pygame.display.set_mode(event.size, pygame.RESIZABLE)
-                elif event.type == KEYDOWN: # L'évènement est "touche appuyée"
-                    # Suivant la touche appuyée, on fait un traitement différent
-                    if event.key == K_q: # A pressé (QWERTY)
-                        self.speed -= 1 # Augmente la vitesse de défilement
-                        if self.speed < 0: # On ne peut pas descendre en dessous de 0
-                            self.speed = 0 
-                    elif event.key == K_w: # Z pressé (QWERTY)
-                        self.speed += 1 # Augmente la vitesse de défilement
-                    elif event.key == K_e: # ...
-                        # Réduit la taille de l'image
-                        self.scale -= 1
-                        if self.scale < 1: # On ne peut pas descendre en dessous de 1
-                            self.scale = 1 
-                        else: # L'image a réduit de taille
-                            # On remplit de noir les zones de l'écran ou il y avait l'ancienne image
-                            self.screen.fill(Color("black"))
-                    elif event.key == K_r:
-                        # Agrandit la taille de l'image
-                        self.scale += 1
-                    elif event.key == K_t:
-                        pass # Rien
+            with self.profiler.section("events"):
+                self.events()
             # On rafraichit l'affichage
             self.refresh()
+            self.profiler.endFrame()
         # On a quitté
+        self.loader.shutdown()
+        self.profiler.close()
+        print("Formats des images: {0}, {1:.1f} Ko gagnés".format(
+            self.frames.formats.report(pygame.display.get_surface()), self.frames.formats.saved() / 1024))
         print("Fin du programme !")
+
+    def events(self):
+        """ Traite les évènements: touches appuyées, fenêtre fermée ou redimensionnée """
+        for event in pygame.event.get():
+            if event.type == QUIT: # L'évènement est de quitter
+                self.quit = True
+                break # On ne traite pas d'évènements supplémentaires
+            elif event.type == VIDEORESIZE: # Redimensionnement de la fenetre
+                # On met la fenetre à la nouvelle taille
+                self.setMode(event.size)
+            elif event.type == KEYDOWN: # L'évènement est "touche appuyée"
+                # Suivant la touche appuyée, on fait un traitement différent
+                if event.key == K_q: # A pressé (QWERTY)
+                    # Augmente la vitesse de défilement
+                    self.playback.faster()
+                elif event.key == K_w: # Z pressé (QWERTY)
+                    # Diminue la vitesse de défilement, pas en dessous de MIN_ANIM_RATE
+                    self.playback.slower()
+                elif event.key == K_e: # ...
+                    # Réduit la taille de l'image
+                    self.scale -= 1
+                    if self.scale < 1: # On ne peut pas descendre en dessous de 1
+                        self.scale = 1 
+                    else: # L'image a réduit de taille
+                        # On remplit de noir les zones de l'écran ou il y avait l'ancienne image
+                        self.screen.fill(Color("black"))
+                elif event.key == K_r:
+                    # Agrandit la taille de l'image
+                    self.scale += 1
+                elif event.key == K_t:
+                    # Agrandit les frames à l'affichage, ou les garde agrandies
+                    self.native = not self.native
+                elif event.key == K_F3:
+                    # Affiche ou cache le temps passé dans chaque étape de l'affichage
+                    self.profiler.toggle()
     
+    def setMode(self, size):
+        """ Ouvre (ou redimensionne) la fenêtre, synchronisée avec l'écran si vsync est demandé """
+        if self.vsync:
+            try:
+                return pygame.display.set_mode(size, pygame.RESIZABLE | pygame.SCALED, vsync = 1)
+            except (AttributeError, TypeError, pygame.error) as e: # Pas de vsync avec ce pygame
+                print("Pas de vsync: {0}".format(e))
+                self.vsync = False
+        return pygame.display.set_mode(size, pygame.RESIZABLE)
+
     def displayParameters(self):
         """ Affiche les paramètres du programme en haut de la fenetre """
         pygame.display.set_caption("Animator v{0}".format(__version__))
     
     def refresh(self):
         """ Rafraichit l'affichage = Redessine l'image """
-        FPS = 60 # 60 images par secondes
-        self.reload_files() # Recharge les fichiers si ils ont changés 
-        self.anim_count += 1 # Incrémente le compteur                                          
-        # On récupère l'image à afficher
-        # Le calcul utilise l'opérateur modulo: '%' et la taille du tableau images (= nombre de frames): 'len(self.images)'
-        if(len(self.images) > 0): # Il faut qu'il y ait au moins une image à afficher !
-            frame = self.images[int(self.anim_count/(self.speed + 1)) % len(self.images)]
+        profiler = self.profiler
+        with profiler.section("reload"):
+            self.reload_files() # Recharge les fichiers si ils ont changés 
+        # On récupère l'image à afficher, d'après le temps écoulé depuis le dernier affichage
+        n = self.playback.update(self.frames.names)
+        if n is not None: # Il faut qu'il y ait au moins une image à afficher !
+            with profiler.section("sprites"):
+                if self.native: # Une seule image agrandie, refaite à chaque affichage
+                    frame = scaleImage(self.frames.image(n, 1), self.scale)
+                else: # L'image agrandie est gardée pour les prochains affichages
+                    frame = self.frames.image(n)
             # On dessine l'image
-            self.screen.blit(frame, (0,0)) # On dessine l'image
+            with profiler.section("composite"):
+                self.screen.blit(frame, (0,0)) # On dessine l'image
         else: # Il n'y a aucune image a afficher :(
             self.screen.fill(Color("gray")) # On remplit l'écran de gris
         
-        self.refreshStatusBar()
+        with profiler.section("status bar"):
+            self.refreshStatusBar()
+            profiler.drawOverlay(self.screen)
         
-        pygame.display.flip() # Obligatoire pour prendre en compte les changements d'affichage
+        with profiler.section("flip"):
+            pygame.display.flip() # Obligatoire pour prendre en compte les changements d'affichage
         
-        self.clock_fps.tick(FPS) # Attend quelques temps pour être sur de ne pas afficher plus vite que 60 FPS
+        with profiler.section("wait"):
+            if self.vsync or not self.render_fps: # flip attend déjà l'écran, ou pas de limite
+                self.clock_fps.tick()
+            else: # Attend quelques temps pour ne pas afficher plus vite que render_fps
+                self.clock_fps.tick(self.render_fps)
         self.displayParameters() # On affiche les parametres
     
     def refreshStatusBar(self):
@@ -133,10 +629,16 @@ class Animator:
         self.status_bar = pygame.Surface((self.screen.get_width(), BAR_HEIGHT))
         # Remplit la barre de gris
         self.status_bar.fill(Color("lightgray"))
+        # Progression du chargement, tant que toutes les images ne sont pas chargées
+        loaded, total = self.frames.progress()
+        loading = "    Loading {}/{}".format(loaded, total) if loaded < total else ""
         # Affiche le texte de la barre dans une zone tampon
+        # Vitesse demandée et vitesse réelle de l'animation, puis de l'affichage
+        playback = self.playback
         status_bar_text = self.status_bar_font.render(
-        "{}    Speed {}    {:.4} FPS".format(
-            self.images_path, self.speed, self.clock_fps.get_fps()),
+        "{}    Anim {} FPS ({} shown, {} skipped)    Render {:.4} FPS    x{}{}{}".format(
+            self.images_path, playback.rate, playback.animFps(), playback.skipped, 
+            self.clock_fps.get_fps(), self.scale, " native" if self.native else "", loading),
             True, # With antialiasing
             Color("black"))
         # Recopie le texte dans la barre de statut
@@ -146,32 +648,49 @@ class Animator:
     
     def reload_files(self):
         """ Lit le dossier et recharge les images qui ont changé """
-        import os
-        import time
-        from glob import glob # On importe la fonction 'glob' depuis le module 'glob'
-        self.images = [] # On vide les images
-        for filename in glob("{0}/*.[pP][nN][gG]".format(self.images_path)):
-            # Pour chaque image trouvée dans le dossier
-            # On relit l'image si elle a été modifiée dans la seconde
-            if not filename in self.images or time.time() - os.getmtime(filename):
-                try: # Utilisé pour gérer les erreurs (appellées "exceptions")
-                    image = pygame.image.load(filename).convert() # On la charge depuis le disque
-                    if self.scale > 1: # On redimensionne l'image
-                        # On redimensionne en gardant les proportions de l'image
-                        width = image.get_width() * self.scale
-                        height = image.get_height() * self.scale
-                        image = pygame.transform.scale(image, (width, height))
-                        
-                    self.images.append(image) # On l'ajoute à la liste des images
-                except: # Au cas ou une erreur à eu lieue depuis le try, on se retrouve la
-                    pass # On ignore l'erreur (par exemple: image illisible ...)
+        # Si la taille a changé, les images agrandies sont faites à partir des images déjà chargées
+        self.frames.setScale(self.scale)
+        self.frames.reload()
+        # On ajoute les images chargées en arrière plan depuis le dernier affichage
+        self.frames.collect()
+        # On prépare à l'avance les frames agrandies, si elles sont gardées
+        if not self.native:
+            self.frames.prepare()
+        # Les durées des frames ont pu changer
+        self.playback.checkDurations()
                 
-def getImagesPath():
+def positive(text):
+    """ Nombre strictement positif et fini donné en argument """
+    import argparse
+    value = float(text)
+    if not value > 0 or math.isinf(value):
+        raise argparse.ArgumentTypeError("{0} is not a positive number".format(text))
+    return value
+
+def getArguments():
+    """ Lit les arguments donnés en lançant le programme """
+    import argparse
+    parser = argparse.ArgumentParser(description = "Plays the frames of a directory as an animation")
+    parser.add_argument("path", nargs = "?", default = None, help = "directory or atlas manifest of the frames")
+    parser.add_argument("--trace", default = None, help = "file to write a Chrome trace of the frames to")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument("--fps", type = positive, default = None, help = "animation frames per second")
+    rate.add_argument("--ms", type = positive, default = None, help = "duration of each animation frame, in ms")
+    parser.add_argument("--durations", default = None,
+        help = "JSON file of the duration of each frame in ms, {0} next to the frames by default".format(DURATIONS_FILE))
+    parser.add_argument("--render-fps", type = int, default = RENDER_FPS,
+        help = "maximum frames drawn per second, 0 for no limit")
+    parser.add_argument("--vsync", action = "store_true", help = "draw at the refresh rate of the screen")
+    parser.add_argument("--native", action = "store_true", 
+        help = "scale the frame shown when drawing it instead of keeping scaled frames")
+    addPaletteOption(parser, "frames")
+    return parser.parse_args()
+
+def getImagesPath(path = None):
     """ Détermine le chemin demandé par l'utilisateur """
     # Si un argument a été donné en lançant le programme: c'est le chemin
-    import sys
-    if len(sys.argv) > 1: # Il y a 1 argument ou plus
-        return sys.argv[1] # On retourne l'argument numéro 1 (le numéro 0 est le nom et le chemin du programme)
+    if path is not None:
+        return path
     else: # Sinon on demande à l'utilisateur de donner le chemin à la main dans la console
         return input("Dossier: ")
         
@@ -180,10 +699,18 @@ def main():
     
     # Initialise pygame (obligatoire de le faire au début)
     pygame.init()
-    # On récupère le dossier ou sont stockées les images
-    path = getImagesPath()
+    # On récupère le dossier ou sont stockées les images, et les options
+    arguments = getArguments()
+    path = getImagesPath(arguments.path)
+    # Vitesse de l'animation, en frames par seconde
+    rate = ANIM_RATE
+    if arguments.fps is not None:
+        rate = arguments.fps
+    elif arguments.ms is not None:
+        rate = 1000 / arguments.ms
     # On lance un programme Animator en 800x600
-    Animator(RESOLUTION, path)
+    Animator(RESOLUTION, path, arguments.trace, rate, arguments.durations, arguments.render_fps, 
+        arguments.vsync, arguments.native, arguments.palette)
 
 if __name__ == "__main__":
     """ Ce code est exécuté quand ce fichier python est lancé directement (double click, 
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+
+import pygame
+
+from spriteindex import SpriteNames
+
+"""
+    Atlas
+
+    Atlas fait partie de la suite logicielle FreeGameTools, il regroupe les
+    sprites d'un dossier dans quelques grandes images (sprite sheets) pour
+    ne décoder qu'un fichier par feuille au démarrage.
+
+    Utilisation: python atlas.py sprites_dir -o atlas.json
+    Les feuilles sont écrites à côté du manifeste: atlas_0.png, atlas_1.png ...
+    Le manifeste peut ensuite remplacer sprites_dir dans SceneCreator et
+    le dossier des images dans Animator.
+
+    Atlas is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+__version__ = "0.1"
+
+# Default maximum width and height of a sheet
+MAX_SIZE = 2048
+
+# Default number of transparent pixels between two sprites
+PADDING = 1
+
+def isAtlas(path):
+    """ Tells if path is an atlas manifest rather than a directory """
+    return path.lower().endswith(".json") and os.path.isfile(path)
+
+class MaxRectsBin:
+    """
+        Rectangle packer using the MaxRects algorithm, best short side fit
+
+        The free space is kept as the list of the maximal free rectangles,
+        which may overlap. A rect is put where it leaves the smallest
+        leftover on its shortest side.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free = [pygame.Rect(0, 0, width, height)]
+        self.used = []
+
+    def insert(self, width, height):
+        """ Places a rect of the given size, returns its position or None if it does not fit """
+        best = None
+        best_score = None
+        for free in self.free:
+            if width <= free.w and height <= free.h:
+                leftover_x = free.w - width
+                leftover_y = free.h - height
+                score = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+                if best_score is None or score < best_score:
+                    best = pygame.Rect(free.x, free.y, width, height)
+                    best_score = score
+        if best is None:
+            return None
+        self.split(best)
+        self.used.append(best)
+        return best.topleft
+
+    def split(self, used):
+        """ Cuts the free rects overlapped by used into the maximal rects around it """
+        kept = []
+        pieces = []
+        for free in self.free:
+            if not free.colliderect(used):
+                kept.append(free)
+                continue
+            if used.left > free.left:
+                pieces.append(pygame.Rect(free.left, free.top, used.left - free.left, free.h))
+            if used.right < free.right:
+                pieces.append(pygame.Rect(used.right, free.top, free.right - used.right, free.h))
+            if used.top > free.top:
+                pieces.append(pygame.Rect(free.left, free.top, free.w, used.top - free.top))
+            if used.bottom < free.bottom:
+                pieces.append(pygame.Rect(free.left, used.bottom, free.w, free.bottom - used.bottom))
+        # A free rect inside another one is useless. The rects kept were maximal
+        # and are not inside the new pieces, which are parts of the rects cut:
+        # only the pieces need to be checked, against each other and the rects kept
+        new_rects = []
+        for n, piece in enumerate(pieces):
+            if any(other.contains(piece) and (other != piece or m < n)
+                    for m, other in enumerate(pieces) if m != n):
+                continue
+            if any(kept[m].contains(piece) for m in piece.collidelistall(kept)):
+                continue
+            new_rects.append(piece)
+        self.free = kept + new_rects
+
+    def usedSize(self):
+        """ Size of the smallest sheet holding all the rects placed """
+        return (max([rect.right for rect in self.used] or [0]),
+            max([rect.bottom for rect in self.used] or [0]))
+
+def packRects(sizes, max_size = MAX_SIZE, padding = PADDING):
+    """
+        Packs rects of the given sizes into as few sheets of at most max_size as possible
+        Returns, in the order of sizes, (sheet number, x, y) of each rect, and the bins
+    """
+    # The rects are padded on their right and bottom side, the bins too so that
+    # a rect touching the border of the sheet does not need padding
+    bins = []
+    places = [None] * len(sizes)
+    # Big rects first, they are the hardest to place
+    for n in sorted(range(len(sizes)), key = lambda n: (-max(sizes[n]), -min(sizes[n]))):
+        width, height = sizes[n]
+        if width > max_size or height > max_size:
+            raise ValueError("A {0}x{1} sprite does not fit in a {2}x{2} sheet".format(width, height, max_size))
+        for sheet, packer in enumerate(bins):
+            pos = packer.insert(width + padding, height + padding)
+            if pos is not None:
+                break
+        else:
+            bins.append(MaxRectsBin(max_size + padding, max_size + padding))
+            sheet = len(bins) - 1
+            pos = bins[-1].insert(width + padding, height + padding)
+        places[n] = (sheet, pos[0], pos[1])
+    return places, bins
+
+def buildAtlas(sprites_dir, manifest_file, max_size = MAX_SIZE, padding = PADDING):
+    """ Packs the sprites found under sprites_dir and writes the sheets and their manifest """
+    from spriteindex import SpriteIndex
+    index = SpriteIndex(sprites_dir, use_inotify = False)
+    names = index.names
+    images = [pygame.image.load(index.find(name)).convert_alpha() for name in names]
+    places, bins = packRects([image.get_size() for image in images], max_size, padding)
+
+    base = os.path.splitext(manifest_file)[0]
+    if os.path.dirname(manifest_file):
+        os.makedirs(os.path.dirname(manifest_file), exist_ok = True)
+    sheets = []
+    for n, packer in enumerate(bins):
+        width, height = packer.usedSize()
+        # The padding of the last column and row is not needed
+        sheet = pygame.Surface((max(width - padding, 1), max(height - padding, 1)), pygame.SRCALPHA)
+        sheet.fill((0, 0, 0, 0))
+        sheets.append(sheet)
+    sprites = {}
+    for name, image, (n, x, y) in zip(names, images, places):
+        # Added to a transparent sheet, the pixels are copied as they are
+        sheets[n].blit(image, (x, y), special_flags = pygame.BLEND_RGBA_ADD)
+        sprites[name] = {
+            "sheet" : n,
+            "rect" : [x, y, image.get_width(), image.get_height()],
+            "path" : os.path.relpath(index.find(name), sprites_dir)
+        }
+    sheet_files = []
+    for n, sheet in enumerate(sheets):
+        sheet_file = "{0}_{1}.png".format(base, n)
+        pygame.image.save(sheet, sheet_file)
+        sheet_files.append(os.path.basename(sheet_file))
+    with open(manifest_file, "w") as f:
+        json.dump({"version" : __version__, "padding" : padding,
+            "sheets" : sheet_files, "sprites" : sprites}, f, indent=0)
+    return len(names), sheets
+
+class Atlas(SpriteNames):
+    """
+        Sprites read from sheets built by buildAtlas
+
+        An atlas can be used in place of a SpriteIndex: the sprites are
+        known by their file name and kept in alphabetical order. Each sheet
+        is decoded once, the sprites are subsurfaces of their sheet.
+    """
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.root = os.path.dirname(manifest_file)
+        self.read()
+
+    def read(self):
+        with open(self.manifest_file, "r") as f:
+            manifest = json.load(f)
+        self.mtime = os.path.getmtime(self.manifest_file)
+        self.sheet_files = [os.path.join(self.root, sheet_file) for sheet_file in manifest["sheets"]]
+        self.sprites = manifest["sprites"]
+        self.sheets = {}
+        self.setNames(self.sprites)
+
+    def poll(self, force = False):
+        """ Reads the manifest again if the atlas was rebuilt, returns True if it was """
+        try:
+            mtime = os.path.getmtime(self.manifest_file)
+        except OSError:
+            return False
+        if mtime != self.mtime:
+            self.read()
+            return True
+        return False
+
+    def find(self, name):
+        """ Path of the sheet holding the sprite, or None if there is no such sprite """
+        sprite = self.sprites.get(name)
+        if sprite is None:
+            return None
+        return self.sheet_files[sprite["sheet"]]
+
+    def sheet(self, n):
+        if not n in self.sheets:
+            self.sheets[n] = pygame.image.load(self.sheet_files[n]).convert_alpha()
+        return self.sheets[n]
+
+    def loadImage(self, name, path = None):
+        """ The sprite, as a subsurface of its sheet """
+        sprite = self.sprites[name]
+        return self.sheet(sprite["sheet"]).subsurface(pygame.Rect(sprite["rect"]))
+
+    def snapshot(self):
+        return None
+
+    def save(self, filename, snapshot = None):
+        pass # Nothing to save, the manifest already is the index
+
+def main(args = None):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description = "Packs a sprites directory into sprite sheets")
+    parser.add_argument("sprites", help = "directory of the sprites")
+    parser.add_argument("-o", "--output", default = "atlas.json", help = "manifest file to write")
+    parser.add_argument("-m", "--max-size", type = int, default = MAX_SIZE,
+        help = "maximum width and height of a sheet")
+    parser.add_argument("-p", "--padding", type = int, default = PADDING,
+        help = "transparent pixels between two sprites")
+    options = parser.parse_args(args)
+
+    from headless import initHeadless
+    initHeadless()
+    start = time.time()
+    count, sheets = buildAtlas(options.sprites, options.output, options.max_size, options.padding)
+    used = sum(sheet.get_width() * sheet.get_height() for sheet in sheets)
+    print("{0} sprites packed in {1} sheets ({2} pixels) in {3:.2f} s".format(
+        count, len(sheets), used, time.time() - start))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import tracemalloc
+
+"""
+    Benchmark
+
+    Benchmark fait partie de la suite logicielle FreeGameTools, il mesure
+    sans fenêtre le temps pris par l'affichage des scènes, la sélection des
+    objets et le rechargement des animations, sur des sprites et des scènes
+    générés au hasard.
+
+    Utilisation: python benchmark.py -o results.json
+    Puis, après une modification:
+        python benchmark.py --baseline results.json --threshold 0.2
+    qui échoue si une mesure est plus de 20% plus lente qu'avant.
+
+    Benchmark is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+__version__ = "0.1"
+
+# Default sizes of the generated scenes, in objects, and animations, in frames
+OBJECTS = [10, 1000, 100000]
+FRAMES = [1, 100, 1000]
+
+# Number of different sprites used by the generated scenes
+SPRITES = 64
+
+# Size of the screen the scenes are drawn on
+SCREEN = (800, 600)
+
+# Objects per screen in the generated scenes, the bigger scenes spread over more screens
+DENSITY = 1000
+
+# Differences in latency below this many seconds are noise, never regressions
+NOISE_FLOOR = 0.00005
+
+# Differences in memory below this many bytes are noise, never regressions
+MEMORY_NOISE_FLOOR = 4096
+
+# Percentiles reported for each operation
+PERCENTILES = [50, 90, 99]
+
+def percentiles(samples):
+    """ Latency statistics of samples, durations in seconds """
+    ordered = sorted(samples)
+    stats = dict(("p{0}".format(p), ordered[min(len(ordered) - 1, len(ordered) * p // 100)])
+        for p in PERCENTILES)
+    stats["min"] = ordered[0]
+    stats["max"] = ordered[-1]
+    stats["mean"] = sum(ordered) / len(ordered)
+    stats["count"] = len(ordered)
+    return stats
+
+def measure(op, runs, surfaces = None):
+    """
+        Times runs calls of op, then calls it once more under tracemalloc
+        tracemalloc only sees the memory allocated by Python, not the pixels of the
+        surfaces: surfaces(), if given, returns the bytes of pixels held after op
+    """
+    samples = []
+    for n in range(runs):
+        start = time.perf_counter()
+        op()
+        samples.append(time.perf_counter() - start)
+    stats = percentiles(samples)
+    tracemalloc.start()
+    try:
+        op()
+        stats["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if surfaces is not None:
+        stats["surface_bytes"] = surfaces()
+    return stats
+
+def makeSprites(directory, count, rng):
+    """ Writes count sprites of random sizes, round and partly transparent """
+    import pygame
+    os.makedirs(directory, exist_ok = True)
+    for n in range(count):
+        width, height = rng.randint(8, 64), rng.randint(8, 64)
+        sprite = pygame.Surface((width, height), pygame.SRCALPHA)
+        sprite.fill((0, 0, 0, 0))
+        color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255), rng.randint(128, 255))
+        pygame.draw.ellipse(sprite, color, sprite.get_rect())
+        pygame.image.save(sprite, os.path.join(directory, "sprite{0:03}.png".format(n)))
+
+def makeScene(filename, sprite_names, count, rng):
+    """ Writes a scene of count objects spread so that a screen shows about DENSITY of them """
+    side = max(1.0, (count / DENSITY) ** 0.5)
+    width, height = int(SCREEN[0] * side), int(SCREEN[1] * side)
+    objects = [[rng.choice(sprite_names), [rng.randrange(width), rng.randrange(height)]]
+        for n in range(count)]
+    with open(filename, "w") as f:
+        json.dump({"resolution" : SCREEN, "objects" : objects}, f)
+    return width, height
+
+def makeFrames(directory, count, rng):
+    """ Writes count frames of an animation """
+    import pygame
+    os.makedirs(directory, exist_ok = True)
+    frame = pygame.Surface((64, 64))
+    for n in range(count):
+        frame.fill((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        pygame.draw.circle(frame, (255, 255, 255), (n % 64, 32), 8)
+        pygame.image.save(frame, os.path.join(directory, "frame{0:04}.png".format(n)))
+
+def benchScene(work_dir, count, runs, rng):
+    """ Times the loading, drawing and picking of a scene of count objects """
+    import pygame
+    from scenecreator import Scene, Camera
+    from spritecache import SpriteCache
+    sprites_dir = os.path.join(work_dir, "sprites")
+    scene_file = os.path.join(work_dir, "scene{0}.json".format(count))
+    width, height = makeScene(scene_file, sorted(os.listdir(sprites_dir)), count, rng)
+    cache = SpriteCache()
+    # The sprites loaded by the cases are the pixels they keep
+    held = lambda: cache.size
+    results = {}
+
+    results["load"] = measure(lambda: Scene(sprites_dir, scene_file, cache), max(1, runs // 10), held)
+    scene = Scene(sprites_dir, scene_file, cache)
+    def index():
+        scene.grid = None
+        scene.spatialIndex()
+    results["index"] = measure(index, max(1, runs // 10), held)
+
+    screen = pygame.Surface(SCREEN)
+    camera = Camera()
+    results["displayOn"] = measure(lambda: scene.displayOn(screen, camera = camera), runs, held)
+    rects = [pygame.Rect(rng.randrange(SCREEN[0] - 64), rng.randrange(SCREEN[1] - 64), 64, 64)
+        for n in range(8)]
+    results["displayOn.dirty"] = measure(lambda: scene.displayOn(screen, rects, camera = camera), runs, held)
+    selected = rng.randrange(count)
+    results["displayOn.selected"] = measure(
+        lambda: scene.displayOn(screen, selected = selected, camera = camera), runs, held)
+
+    points = [(rng.randrange(width), rng.randrange(height)) for n in range(runs)]
+    points = iter(points * 2)
+    results["objectAt"] = measure(lambda: scene.objectAt(next(points)), runs, held)
+
+    names = scene.listAllImages()
+    results["getImage"] = measure(lambda: scene.getImage(rng.choice(names)), runs * 10, held)
+    return results
+
+def benchFrames(work_dir, count, runs, rng):
+    """ Times the loading of an animation of count frames, then its reloads when nothing changed """
+    from animator import FrameSet
+    from surfaceformat import surfaceBytes
+    frames_dir = os.path.join(work_dir, "frames{0}".format(count))
+    makeFrames(frames_dir, count, rng)
+    # The frames and their scaled copies are the pixels kept by the last frame set loaded
+    loaded = []
+    def held():
+        frames = loaded[-1]
+        return frames.scaled_size + sum(surfaceBytes(image) for image in frames.images)
+    def cold():
+        loaded[:] = [FrameSet(frames_dir)]
+        loaded[-1].reload(force = True)
+    results = {}
+    results["reload.cold"] = measure(cold, max(1, runs // 10), held)
+    cold()
+    frames = loaded[-1]
+    results["reload.warm"] = measure(lambda: frames.reload(force = True), runs, held)
+    return results
+
+def runAll(objects = OBJECTS, frames = FRAMES, runs = 50, seed = 0, work_dir = None):
+    """ Runs every benchmark, returns the results as a JSON-ready dictionary """
+    from headless import initHeadless
+    initHeadless()
+    import pygame
+    rng = random.Random(seed)
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix = "fgt-benchmark-")
+    cases = {}
+    try:
+        makeSprites(os.path.join(work_dir, "sprites"), SPRITES, rng)
+        for count in objects:
+            print("Scene of {0} objects".format(count), file = sys.stderr)
+            for name, stats in benchScene(work_dir, count, runs, rng).items():
+                cases["scene.{0}[objects={1}]".format(name, count)] = stats
+        for count in frames:
+            print("Animation of {0} frames".format(count), file = sys.stderr)
+            for name, stats in benchFrames(work_dir, count, runs, rng).items():
+                cases["frames.{0}[frames={1}]".format(name, count)] = stats
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors = True)
+    return {
+        "version" : __version__,
+        "python" : sys.version.split()[0],
+        "pygame" : pygame.version.ver,
+        "seed" : seed,
+        "runs" : runs,
+        "cases" : cases
+    }
+
+def compare(results, baseline, threshold, metric = "p50"):
+    """
+        Cases slower, or using more memory, than in baseline by more than threshold
+        Returns a list of (case, what, baseline value, new value)
+    """
+    regressions = []
+    for case, stats in sorted(results["cases"].items()):
+        old = baseline.get("cases", {}).get(case)
+        if old is None:
+            continue # New case: nothing to compare with
+        if stats[metric] > old[metric] * (1 + threshold) and stats[metric] - old[metric] > NOISE_FLOOR:
+            regressions.append((case, metric, old[metric], stats[metric]))
+        for what in ("peak_bytes", "surface_bytes"):
+            if not what in stats or not what in old:
+                continue # Measured by a newer version only
+            if stats[what] > old[what] * (1 + threshold) and stats[what] - old[what] > MEMORY_NOISE_FLOOR:
+                regressions.append((case, what, old[what], stats[what]))
+    return regressions
+
+def sizes(text):
+    return [int(size) for size in text.split(",") if size]
+
+def main(args = None):
+    import argparse
+    import contextlib
+    parser = argparse.ArgumentParser(description = "Times the hot paths of SceneCreator and Animator")
+    parser.add_argument("-o", "--output", default = None, help = "JSON file of the results, printed by default")
+    parser.add_argument("--objects", type = sizes, default = OBJECTS,
+        help = "objects in the generated scenes, comma separated")
+    parser.add_argument("--frames", type = sizes, default = FRAMES,
+        help = "frames in the generated animations, comma separated")
+    parser.add_argument("-n", "--runs", type = int, default = 50, help = "timed calls of each operation")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the generated sprites and scenes")
+    parser.add_argument("--work-dir", default = None,
+        help = "directory of the generated files, a temporary one by default")
+    parser.add_argument("-b", "--baseline", default = None, help = "results to compare with")
+    parser.add_argument("-t", "--threshold", type = float, default = 0.2,
+        help = "relative slowdown counted as a regression")
+    parser.add_argument("-m", "--metric", default = "p50", help = "latency statistic compared with the baseline")
+    options = parser.parse_args(args)
+
+    # The tools print what they do: only the results go to the standard output
+    with contextlib.redirect_stdout(sys.stderr):
+        results = runAll(options.objects, options.frames, options.runs, options.seed, options.work_dir)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+    else:
+        json.dump(results, sys.stdout, indent = 1, sort_keys = True)
+        print()
+
+    if options.baseline:
+        with open(options.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.threshold, options.metric)
+        for case, what, old, new in regressions:
+            print("Regression in {0}: {1} {2:.6g} -> {3:.6g} ({4:+.0%})".format(
+                case, what, old, new, new / old - 1 if old else float("inf")), file = sys.stderr)
+        if regressions:
+            return 1
+        print("No regression above {0:.0%}".format(options.threshold), file = sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import os
+
+"""
+    Headless
+
+    Headless fait partie de la suite logicielle FreeGameTools, il initialise
+    pygame sans ouvrir de fenêtre, pour les outils en ligne de commande.
+
+    Headless is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+def initHeadless():
+    """ 
+        Initialises pygame with the SDL dummy video driver
+        A 1x1 display mode is set so that surfaces can be converted
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import pygame
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
@@ -0,0 +1,179 @@
+import sys
+import json
+import time
+
+"""
+    Overlaps
+
+    Overlaps fait partie de la suite logicielle FreeGameTools, il trouve
+    sans fenêtre les objets qui se chevauchent dans des scènes faites avec
+    SceneCreator, au pixel près, et écrit la liste en JSON.
+
+    Utilisation: python overlaps.py -s sprites_dir -o overlaps.json scene_files...
+    Ou scene_files sont des fichiers de scène ou des motifs (scenes/*.json).
+
+    Overlaps is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+__version__ = "0.1"
+
+def candidatePairs(grid):
+    """
+        Pairs of keys of the grid whose rects overlap, each pair once
+        The objects of each cell are swept along x: only the rects still open
+        when a rect starts are compared with it.
+    """
+    rects = grid.rects
+    size = grid.cell_size
+    pairs = []
+    for cell, keys in grid.cells.items():
+        if len(keys) < 2:
+            continue
+        active = []
+        for key in sorted(keys, key = lambda key: rects[key].left):
+            rect = rects[key]
+            active = [other for other in active if rects[other].right > rect.left]
+            for other in active:
+                other_rect = rects[other]
+                if other_rect.top < rect.bottom and rect.top < other_rect.bottom:
+                    # The pair is in every cell of its intersection: only the cell of its corner keeps it
+                    if (rect.left // size, max(rect.top, other_rect.top) // size) == cell:
+                        pairs.append((other, key))
+            active.append(key)
+    return pairs
+
+def findOverlaps(scene, min_area = 1):
+    """
+        Objects of scene whose opaque pixels overlap on at least min_area pixels
+        Returns the number of pairs of overlapping rects and the overlaps found,
+        as dictionaries, ordered by object number
+    """
+    grid = scene.spatialIndex()
+    order = scene.objectsOrder()
+    pairs = sorted((order[a], a, order[b], b) if order[a] < order[b] else (order[b], b, order[a], a)
+        for a, b in candidatePairs(grid))
+    # The same sprites come back in many pairs: their masks are only asked once to the cache
+    masks = {}
+    overlaps = []
+    for a, key_a, b, key_b in pairs:
+        name_a, name_b = scene.store.name(a), scene.store.name(b)
+        for name in (name_a, name_b):
+            if not name in masks:
+                masks[name] = scene.getMask(name)
+        mask_a, mask_b = masks[name_a], masks[name_b]
+        if mask_a is None or mask_b is None:
+            continue
+        # The masks are the ones of the trimmed sprites, as the rects of the grid
+        rect_a, rect_b = grid.rects[key_a], grid.rects[key_b]
+        offset = (rect_b.x - rect_a.x, rect_b.y - rect_a.y)
+        area = mask_a.overlap_area(mask_b, offset)
+        if area < min_area:
+            continue
+        x, y = mask_a.overlap(mask_b, offset)
+        overlaps.append({
+            "objects" : [a, b],
+            "sprites" : [name_a, name_b],
+            "area" : area,
+            "point" : [rect_a.x + x, rect_a.y + y],
+            "rect" : list(rect_a.clip(rect_b))
+        })
+    return len(pairs), overlaps
+
+def analyseScene(scene_file, min_area = 1):
+    """ Report of the overlaps of a scene, loaded with the caches of the worker """
+    import contextlib
+    from scenerender import loadScene
+    start = time.time()
+    # The scenes print what they load: only the report goes to the standard output
+    with contextlib.redirect_stdout(sys.stderr):
+        scene = loadScene(scene_file)
+    candidates, overlaps = findOverlaps(scene, min_area)
+    return {
+        "scene" : scene_file,
+        "objects" : len(scene.store),
+        "candidates" : candidates,
+        "overlaps" : overlaps,
+        "time" : time.time() - start
+    }
+
+def encodeScene(scene_file, min_area = 1):
+    """
+        Analyses a scene, returns (number of overlaps, error, report in JSON)
+        The report is encoded by the worker: sending text back is much faster than the dictionaries
+    """
+    try:
+        report = analyseScene(scene_file, min_area)
+    except Exception as e:
+        return 0, str(e), json.dumps({"scene" : scene_file, "error" : str(e)})
+    return len(report["overlaps"]), None, json.dumps(report)
+
+def analyseAll(scene_files, sprites_dir, jobs = None, min_area = 1):
+    """
+        Analyses the scenes on a pool of jobs processes
+        Returns the results of encodeScene in the order of scene_files
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from scenerender import initWorker
+    if jobs == 1:
+        initWorker(sprites_dir)
+        return [encodeScene(scene_file, min_area) for scene_file in scene_files]
+    results = []
+    with ProcessPoolExecutor(jobs, initializer = initWorker, initargs = (sprites_dir,)) as pool:
+        futures = [(scene_file, pool.submit(encodeScene, scene_file, min_area)) for scene_file in scene_files]
+        for scene_file, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e: # The worker died
+                results.append((0, str(e), json.dumps({"scene" : scene_file, "error" : str(e)})))
+    return results
+
+def main(args = None):
+    import argparse
+    from scenerender import findScenes
+    parser = argparse.ArgumentParser(description = "Finds the overlapping objects of SceneCreator scenes")
+    parser.add_argument("scenes", nargs = "+", help = "scene files or patterns")
+    parser.add_argument("-s", "--sprites", default = ".", help = "directory or atlas manifest of the sprites")
+    parser.add_argument("-o", "--output", default = None, help = "JSON file of the report, printed by default")
+    parser.add_argument("-j", "--jobs", type = int, default = None,
+        help = "number of worker processes, one per CPU by default")
+    parser.add_argument("-a", "--min-area", type = int, default = 1,
+        help = "opaque pixels two objects must share to overlap")
+    options = parser.parse_args(args)
+
+    scene_files = findScenes(options.scenes)
+    start = time.time()
+    results = analyseAll(scene_files, options.sprites, options.jobs, options.min_area)
+    # {"version": ..., "min_area": ..., "scenes": [report of each scene]}
+    header = json.dumps({"version" : __version__, "min_area" : options.min_area})
+    text = '{0}, "scenes": [{1}]}}'.format(header[:-1], ", ".join(report for count, error, report in results))
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    failed = 0
+    for scene_file, (count, error, report) in zip(scene_files, results):
+        if error is not None:
+            print("{0}: {1}".format(scene_file, error), file = sys.stderr)
+            failed += 1
+    print("{0} overlaps in {1} scenes, {2} failed, in {3:.2f} s".format(
+        sum(count for count, error, report in results), len(results), failed, time.time() - start),
+        file = sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+from collections import deque
+
+"""
+    Profiler
+
+    Profiler fait partie de la suite logicielle FreeGameTools, il mesure
+    le temps passé dans chaque étape de l'affichage d'une image, l'affiche
+    par dessus la fenêtre et peut l'enregistrer au format trace de Chrome
+    (chrome://tracing, Perfetto).
+
+    Profiler is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+# Number of frames the percentiles and the graph are computed on
+HISTORY = 120
+
+# Frame time shown at the top of the graph, in seconds, and the target frame time
+GRAPH_SCALE = 1 / 30
+TARGET = 1 / 60
+
+class NullSection:
+    """ Section used while profiling is off: does nothing """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SECTION = NullSection()
+
+class Section:
+    """ Times the code run in a with block """
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter())
+        return False
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+
+class FrameProfiler:
+    """
+        Time spent in each section of the frames
+
+        The sections are with blocks: with profiler.section("flip"): ...
+        While the overlay is hidden and no trace is recorded, section returns
+        a shared object doing nothing, so the instrumentation costs a call.
+    """
+    def __init__(self, trace_file = None, history = HISTORY):
+        self.history = history
+        self.shown = False
+        # Section names in the order they were first seen, and the time of each one per frame
+        self.names = []
+        self.times = {}
+        self.frames = deque(maxlen = history)
+        # Time of each section during the current frame
+        self.current = {}
+        self.frame_start = None
+        # Trace events, recorded only if there is a trace file
+        self.trace_file = trace_file
+        self.events = [] if trace_file else None
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.font = None
+        self.active = self.events is not None
+
+    def toggle(self):
+        """ Shows or hides the overlay, the history starts again when it is shown """
+        self.shown = not self.shown
+        if self.shown:
+            self.frames.clear()
+            for times in self.times.values():
+                times.clear()
+        self.active = self.shown or self.events is not None
+
+    def section(self, name):
+        if not self.active:
+            return NULL_SECTION
+        return Section(self, name)
+
+    def add(self, name, start, end):
+        """ Counts end - start seconds spent in the section name """
+        self.current[name] = self.current.get(name, 0) + end - start
+        if self.events is not None:
+            self.events.append({"name" : name, "ph" : "X", "pid" : self.pid, "tid" : 0,
+                "ts" : (start - self.origin) * 1e6, "dur" : (end - start) * 1e6})
+
+    def beginFrame(self):
+        if self.active:
+            self.frame_start = time.perf_counter()
+            self.current = {}
+
+    def endFrame(self):
+        if not self.active or self.frame_start is None:
+            return
+        end = time.perf_counter()
+        self.frames.append(end - self.frame_start)
+        for name in self.names:
+            self.times[name].append(self.current.get(name, 0))
+        for name in self.current:
+            if not name in self.times:
+                self.names.append(name)
+                self.times[name] = deque([self.current[name]], maxlen = self.history)
+        if self.events is not None:
+            self.events.append({"name" : "frame", "ph" : "X", "pid" : self.pid, "tid" : 0,
+                "ts" : (self.frame_start - self.origin) * 1e6, "dur" : (end - self.frame_start) * 1e6})
+        self.frame_start = None
+
+    def stats(self):
+        """ (name, p50, p95, max) of the frame and of each section, in seconds """
+        rows = []
+        for name, times in [("frame", self.frames)] + [(name, self.times[name]) for name in self.names]:
+            if times:
+                ordered = sorted(times)
+                rows.append((name, percentile(ordered, 50), percentile(ordered, 95), ordered[-1]))
+        return rows
+
+    def drawOverlay(self, surface, pos = (5, 5)):
+        """ Draws the breakdown and the frame time graph on surface, returns the rect drawn """
+        import pygame
+        if not self.shown:
+            return None
+        if self.font is None:
+            self.font = pygame.font.SysFont("monospace", 12)
+        lines = ["{:<12} {:>6} {:>6} {:>6}".format("ms", "p50", "p95", "max")]
+        for name, p50, p95, highest in self.stats():
+            lines.append("{:<12} {:>6.2f} {:>6.2f} {:>6.2f}".format(name, p50 * 1000, p95 * 1000, highest * 1000))
+        texts = [self.font.render(line, True, pygame.Color("white")) for line in lines]
+        line_height = self.font.get_linesize()
+        graph_height = 40
+        width = max([self.history] + [text.get_width() for text in texts]) + 10
+        height = line_height * len(texts) + graph_height + 15
+        # Opaque, so that drawing it again over the last one gives the same pixels
+        overlay = pygame.Surface((width, height))
+        overlay.fill((0, 0, 0))
+        for n, text in enumerate(texts):
+            overlay.blit(text, (5, 5 + n * line_height))
+
+        # One bar per frame, the line is the target frame time
+        bottom = height - 5
+        for n, frame_time in enumerate(self.frames):
+            bar = min(graph_height, int(frame_time / GRAPH_SCALE * graph_height))
+            color = pygame.Color("green") if frame_time <= TARGET else pygame.Color("red")
+            pygame.draw.line(overlay, color, (5 + n, bottom), (5 + n, bottom - bar))
+        target = bottom - int(TARGET / GRAPH_SCALE * graph_height)
+        pygame.draw.line(overlay, pygame.Color("yellow"), (5, target), (5 + self.history, target))
+        return surface.blit(overlay, pos)
+
+    def close(self):
+        """ Writes the trace file, if there is one """
+        if self.events is None:
+            return
+        with open(self.trace_file, "w") as f:
+            json.dump({"traceEvents" : self.events, "displayTimeUnit" : "ms"}, f)
+        print("Trace of {0} frames saved to {1}".format(
+            sum(1 for event in self.events if event["name"] == "frame"), self.trace_file))
@@ -0,0 +1,351 @@
+import os
+import io
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+"""
+    RenderServer
+
+    RenderServer fait partie de la suite logicielle FreeGameTools, c'est un
+    serveur HTTP local qui crée à la demande des aperçus PNG de scènes et de
+    frames d'animations. Les sprites décodés et les scènes chargées restent
+    en mémoire d'une requête à l'autre.
+
+    Utilisation: python renderserver.py -s sprites_dir -r root_dir
+    Puis, par exemple:
+        http://localhost:8765/scene?file=scenes/level1.json&zoom=2
+        http://localhost:8765/frame?path=anims/walk&n=3
+    Les chemins sont relatifs à root_dir.
+
+    RenderServer is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+__version__ = "0.1"
+
+# Port the server listens to, on localhost only
+PORT = 8765
+
+# Number of worker processes rendering the previews
+JOBS = 2
+
+# Scenes and animations kept loaded by each worker, the least recently used are forgotten
+WARM_ITEMS = 16
+
+# Memory of the PNG responses kept by the server, in bytes
+RESPONSE_BUDGET = 32 * 1024 * 1024
+
+def contentHash(*parts):
+    return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def encodePng(surface):
+    import pygame
+    data = io.BytesIO()
+    pygame.image.save(surface, data, "png")
+    return data.getvalue()
+
+def initServerWorker(sprites_dir, palette = False):
+    """ Initialises a worker process: the caches of scenerender, and the scenes and animations it keeps """
+    from scenerender import initWorker, worker
+    initWorker(sprites_dir, palette = palette)
+    worker["palette"] = palette
+    # scene file -> (signature, scene) and animation path -> frames, the least recently used first
+    worker["scenes"] = OrderedDict()
+    worker["animations"] = OrderedDict()
+
+def remember(items, key, value):
+    items[key] = value
+    items.move_to_end(key)
+    while len(items) > WARM_ITEMS:
+        items.popitem(last = False)
+
+def warmScene(scene_file):
+    """ The scene loaded by the worker and its signature, loaded again if it changed """
+    import contextlib
+    from scenerender import worker, loadScene, sceneSignature
+    scenes = worker["scenes"]
+    entry = scenes.get(scene_file)
+    if entry is not None:
+        worker["sprites"].poll()
+        signature = sceneSignature(scene_file, entry[1])
+        if signature == entry[0]:
+            scenes.move_to_end(scene_file)
+            return entry
+    # The scenes print what they load: keep the log of the server readable
+    with contextlib.redirect_stdout(sys.stderr):
+        scene = loadScene(scene_file)
+    entry = (sceneSignature(scene_file, scene), scene)
+    remember(scenes, scene_file, entry)
+    return entry
+
+def renderScene(scene_file, x = 0, y = 0, zoom = 1, size = None, known = ()):
+    """
+        Renders a scene as seen through a camera, returns (etag, PNG data)
+        The PNG data is None if the etag is one of known: the client has it already
+    """
+    import pygame
+    from scenecreator import Camera
+    signature, scene = warmScene(scene_file)
+    size = tuple(size or scene.resolution)
+    etag = contentHash("scene", signature, x, y, zoom, size)
+    if etag in known:
+        return etag, None
+    surface = pygame.Surface(size)
+    scene.displayOn(surface, camera = Camera(x, y, zoom))
+    return etag, encodePng(surface)
+
+def renderFrame(path, n = 0, scale = 1, known = ()):
+    """ Renders the frame n of the animation in path, directory or atlas, returns (etag, PNG data) """
+    from scenerender import worker
+    from animator import FrameSet
+    animations = worker["animations"]
+    frames = animations.get(path)
+    if frames is None:
+        frames = FrameSet(path, palette = worker["palette"])
+        frames.reload(force = True)
+    else:
+        frames.reload()
+    remember(animations, path, frames)
+    if not 0 <= n < len(frames.names):
+        raise IndexError("{0} has {1} frames".format(path, len(frames.names)))
+    name = frames.names[n]
+    etag = contentHash("frame", path, name, frames.files[name], scale)
+    if etag in known:
+        return etag, None
+    return etag, encodePng(frames.image(n, scale))
+
+# Renderers of the requests, by path
+RENDERERS = {"/scene" : renderScene, "/frame" : renderFrame}
+
+class RenderServer:
+    """
+        Renders the previews on a pool of worker processes and keeps the last
+        responses, keyed on the request
+
+        Each worker keeps its own caches, warmed by the requests it was given.
+        The workers compute the etag of each request first: the preview is
+        only rendered again if it is not the one the server has. Identical
+        requests arriving together share the same rendering.
+    """
+    def __init__(self, sprites_dir, root = ".", jobs = JOBS, budget = RESPONSE_BUDGET, palette = False):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        self.root = os.path.realpath(root)
+        if jobs == 1:
+            self.pool = ThreadPoolExecutor(1, initializer = initServerWorker, initargs = (sprites_dir, palette))
+        else:
+            # Not forked from the server: the workers would keep its socket open after it stopped
+            self.pool = ProcessPoolExecutor(jobs, mp_context = multiprocessing.get_context("forkserver"),
+                initializer = initServerWorker, initargs = (sprites_dir, palette))
+        self.budget = budget
+        # (path, arguments) -> (etag, PNG data), the least recently used first
+        self.responses = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rendered = 0
+        self.not_modified = 0
+        self.cached = 0
+        # Requests which joined the same request being rendered
+        self.shared = 0
+        # (path, arguments) -> future of the request being rendered
+        self.pending = {}
+
+    def resolve(self, path):
+        """ Path of a file given in a request, None if it is outside of the root directory """
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if resolved != self.root and not resolved.startswith(self.root + os.sep):
+            return None
+        return resolved
+
+    def submit(self, key):
+        """ Asks a worker for the response to key, or joins the same request if it is being rendered """
+        future = self.pending.get(key)
+        if future is not None:
+            self.shared += 1
+            return future
+        # The worker only renders the preview if it is not the one the server has
+        cached = self.responses.get(key)
+        path, arguments = key
+        future = self.pool.submit(RENDERERS[path], *arguments, known = () if cached is None else (cached[0],))
+        self.pending[key] = future
+        return future
+
+    def store(self, key, etag, data):
+        old = self.responses.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self.responses[key] = (etag, data)
+        self.size += len(data)
+        # The most recent response is always kept, even if it is bigger than the budget
+        while self.size > self.budget and len(self.responses) > 1:
+            self.size -= len(self.responses.popitem(last = False)[1][1])
+
+    def render(self, path, arguments, client_etags = ()):
+        """
+            Returns (etag, PNG data) of a request
+            The PNG data is None if the client has this etag already
+        """
+        key = (path, arguments)
+        with self.lock:
+            self.requests += 1
+            future = self.submit(key)
+        try:
+            etag, data = future.result()
+        finally:
+            with self.lock:
+                if self.pending.get(key) is future:
+                    del self.pending[key]
+        with self.lock:
+            if data is not None and self.responses.get(key, (None,))[0] != etag:
+                self.rendered += 1
+                self.store(key, etag, data)
+            if etag in client_etags:
+                self.not_modified += 1
+                return etag, None
+            if data is None:
+                cached = self.responses.get(key)
+                if cached is not None and cached[0] == etag:
+                    self.cached += 1
+                    self.responses.move_to_end(key)
+                    data = cached[1]
+        if data is None: # The response was evicted meanwhile
+            etag, data = self.pool.submit(RENDERERS[path], *arguments).result()
+        return etag, data
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests" : self.requests,
+                "rendered" : self.rendered,
+                "not_modified" : self.not_modified,
+                "cached" : self.cached,
+                "shared" : self.shared,
+                "responses" : len(self.responses),
+                "bytes" : self.size
+            }
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+def makeHandler(server):
+    """ Request handler class of the HTTP server, rendering with server """
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "RenderServer/" + __version__
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+            if url.path == "/stats":
+                self.reply(200, "application/json", json.dumps(server.stats()).encode("utf-8"))
+                return
+            if not url.path in RENDERERS:
+                self.send_error(404, "Unknown request")
+                return
+            try:
+                arguments = self.arguments(url.path, query)
+            except (KeyError, ValueError) as e:
+                self.send_error(400, "Bad parameter {0}".format(e))
+                return
+            if arguments[0] is None:
+                self.send_error(403, "Outside of the root directory")
+                return
+            client_etags = [etag.strip().strip('"') for etag in self.headers.get("If-None-Match", "").split(",")]
+            try:
+                etag, data = server.render(url.path, arguments, tuple(etag for etag in client_etags if etag))
+            except (IOError, OSError, IndexError) as e:
+                self.send_error(404, str(e))
+                return
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            if data is None:
+                self.send_response(304)
+                self.send_header("ETag", '"{0}"'.format(etag))
+                self.end_headers()
+            else:
+                self.reply(200, "image/png", data, etag)
+
+        def arguments(self, path, query):
+            """ Arguments of the renderer of path, from the parameters of the request """
+            if path == "/scene":
+                size = None
+                if "width" in query or "height" in query:
+                    size = (int(query["width"]), int(query["height"]))
+                zoom = int(query.get("zoom", 1))
+                if zoom < 1 or (size is not None and min(size) < 1):
+                    raise ValueError("zoom" if zoom < 1 else "size")
+                return (server.resolve(query["file"]), int(query.get("x", 0)), int(query.get("y", 0)), zoom, size)
+            scale = int(query.get("scale", 1))
+            if scale < 1:
+                raise ValueError("scale")
+            return (server.resolve(query["path"]), int(query.get("n", 0)), scale)
+
+        def reply(self, code, content_type, data, etag = None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            if etag is not None:
+                self.send_header("ETag", '"{0}"'.format(etag))
+                # The client may keep the preview, but must check it did not change
+                self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def main(args = None):
+    import signal
+    import argparse
+    from http.server import HTTPServer
+    from surfaceformat import addPaletteOption
+    from socketserver import ThreadingMixIn
+    parser = argparse.ArgumentParser(description = "Serves PNG previews of scenes and animations on localhost")
+    parser.add_argument("-s", "--sprites", default = ".", help = "directory or atlas manifest of the sprites")
+    parser.add_argument("-r", "--root", default = ".", help = "directory the scenes and animations are read from")
+    parser.add_argument("-p", "--port", type = int, default = PORT, help = "port to listen to")
+    parser.add_argument("-j", "--jobs", type = int, default = JOBS, help = "number of worker processes")
+    parser.add_argument("-q", "--quiet", action = "store_true", help = "do not log the requests")
+    addPaletteOption(parser, "sprites and frames")
+    options = parser.parse_args(args)
+
+    class ThreadingServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = RenderServer(options.sprites, options.root, options.jobs, palette = options.palette)
+    Handler = makeHandler(server)
+    if options.quiet:
+        Handler.log_message = lambda self, format, *args: None
+    httpd = ThreadingServer(("127.0.0.1", options.port), Handler)
+    print("Serving previews of {0} on http://localhost:{1}/".format(server.root, httpd.server_address[1]), flush = True)
+    # Stopped by kill as by Ctrl-C: the workers are shut down too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
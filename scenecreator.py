@@ -1,6 +1,16 @@
+import time
+
 import pygame
 from pygame.locals import *
 
+from spritecache import SpriteCache
+from spriteindex import SpriteIndex
+from spatialindex import SpatialGrid
+from atlas import Atlas, isAtlas
+from scenestore import ListStore, ColumnStore, isBinary, loadScene, saveBinary, atomicWrite
+from scenejournal import Journal
+from profiler import FrameProfiler
+
 __version__ = "0.1"
 
 """
@@ -32,6 +42,80 @@ __version__ = "0.1"
     Copyright 2012, Léo Germond
 """
 
+# Above this number of changed regions, the whole scene is drawn again
+MAX_DAMAGE = 256
+
+# Minimum delay between two writes of the edits journal, in seconds
+AUTOSAVE_INTERVAL = 1.0
+
+# Above this number of edits in the journal, the scene is saved in the background
+COMPACT_EDITS = 1000
+
+def mergeRects(rects):
+    """ Merges the overlapping rects together, so that no pixel is drawn twice """
+    merged = []
+    for rect in rects:
+        rect = Rect(rect)
+        # Merging two rects can make the result overlap a rect already merged
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+def openSprites(sprites_dir, snapshot = None):
+    """ 
+        Index of the sprites of sprites_dir, which can also be an atlas manifest
+        The index is loaded from the snapshot file if there is one
+    """
+    if isAtlas(sprites_dir):
+        return Atlas(sprites_dir)
+    if snapshot is None:
+        return SpriteIndex(sprites_dir)
+    return SpriteIndex.load(sprites_dir, snapshot)
+
+class Camera:
+    """ 
+        Part of the scene shown on screen: the scene position of the top left 
+        corner of the screen and the zoom factor
+    """
+    def __init__(self, x = 0, y = 0, zoom = 1):
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+
+    def state(self):
+        return (self.x, self.y, self.zoom)
+
+    def toScreen(self, pos):
+        return ((pos[0] - self.x) * self.zoom, (pos[1] - self.y) * self.zoom)
+
+    def toScene(self, pos):
+        return (pos[0] // self.zoom + self.x, pos[1] // self.zoom + self.y)
+
+    def screenRect(self, rect):
+        """ Rect of the screen showing rect, a rect of the scene """
+        rect = Rect(rect)
+        return Rect(self.toScreen(rect.topleft), (rect.w * self.zoom, rect.h * self.zoom))
+
+    def sceneRect(self, rect):
+        """ Smallest rect of the scene covering rect, a rect of the screen """
+        rect = Rect(rect)
+        left, top = self.toScene(rect.topleft)
+        right = -(-rect.right // self.zoom) + self.x
+        bottom = -(-rect.bottom // self.zoom) + self.y
+        return Rect(left, top, right - left, bottom - top)
+
+    def zoomAt(self, pos, zoom):
+        """ Changes the zoom, the scene point under pos, a screen position, stays in place """
+        if zoom < 1:
+            return
+        x, y = self.toScene(pos)
+        self.zoom = zoom
+        self.x = x - pos[0] // zoom
+        self.y = y - pos[1] // zoom
+
 class Scene:
     file_data = {
         "resolution" : (800,600),
@@ -40,110 +124,514 @@ class Scene:
         "background" : "black"
     }
     
-    def __init__(self, sprites_dir = ".", scene_file = None):
-        import json
+    def __init__(self, sprites_dir = ".", scene_file = None, cache = None, sprites = None, columnar = False):
+        """
+            Loads the scene from scene_file, its sprites are found in sprites_dir
+            A sprite cache and a sprite index can be shared between scenes
+            With columnar, or with a binary scene file, the objects are kept in typed arrays
+        """
         print("Launching with sprite dir {0} and scene file {1}".format(sprites_dir, scene_file))
         self.sprites_dir = sprites_dir
+        self.cache = SpriteCache() if cache is None else cache
+        # Grid of the object rects and position of each object, built when needed
+        self.grid = None
+        self.grid_scale = None
+        self.order = None
+        # Regions changed since the last frame, everything is to redraw at first
+        self.damage = []
+        self.damage_all = True
+        self.cache_reloads = self.cache.reloads
+        # Objects below and above the selected object, composited once: (key, below, above)
+        self.baked = None
+        # Objects drawn and culled by the last call to displayOn
+        self.drawn = 0
+        self.culled = 0
+        # Edits made since the last save, and the thread writing the saves
+        self.journal = None
+        self.replaying = False
+        self.last_autosave = time.time()
+        self.saver = None
+        self.saving = None
+        self.flushing = None
+        self.save_error = None
+        # Times the steps of displayOn when the editor shows its profiling overlay
+        self.profiler = FrameProfiler()
+        # With native, a zoomed view is drawn at zoom 1 then scaled up once
+        self.native = False
+        self.native_surface = None
         if scene_file == None:
             self.scene = {}
+            self.sprites = openSprites(sprites_dir) if sprites is None else sprites
         else:
             self.scene_file = scene_file              
+            if sprites is None:
+                sprites = openSprites(sprites_dir, self.indexFile())
+            self.sprites = sprites
             try:
-                with open(self.scene_file, "r") as f:
-                    self.scene = json.load(f)
+                self.scene = loadScene(self.scene_file)
             except IOError:
                 self.scene = {}
-                
-            print("{0} scene loaded with {1} objects".format(self.resolution, len(self.objects)))
+        self.useObjects(self.scene.get("objects", []), columnar or isBinary(scene_file or ""))
+        if scene_file != None:
+            self.replay()
+            print("{0} scene loaded with {1} objects".format(self.resolution, len(self.store)))
         
-    def displayOn(self, surface):
-        surface.fill(pygame.Color(self.background), pygame.Rect((0,0),  self.resolution))
-        for sprite_name, position in self.objects:
-            sprite = self.getImage(sprite_name)
-            surface.blit(sprite, position)
-
-    def getImage(self, sprite_name):
-        import os
-        image = None
-        for dirpath, dirnames, filenames in os.walk(self.sprites_dir):
-            if sprite_name in filenames:
-                image =  pygame.image.load(os.path.join(dirpath, sprite_name)).convert_alpha()
-        if self.scale > 1:
-            image = pygame.transform.scale(image, (self.scale * image.get_width(), self.scale * image.get_height()))
-        return image
-    
+    def displayOn(self, surface, rects = None, selected = None, camera = None):
+        """ 
+            Draws the scene on surface, as seen through camera
+            If rects is given, only these rects of surface are drawn again
+            If selected is given, the other objects are drawn from layers baked by bake
+            Only the objects visible through the camera are drawn, the others are culled
+        """
+        if camera is None:
+            camera = Camera()
+        if self.native and camera.zoom > 1:
+            self.displayNative(surface, rects, selected, camera)
+            return
+        if rects is None:
+            self.checkSprites()
+            rects = [surface.get_rect()]
+
+        profiler = self.profiler
+        if selected is not None:
+            with profiler.section("bake"):
+                key, below, above = self.bake(selected, camera, surface.get_size())
+            with profiler.section("sprites"):
+                sprite, position = self.getSprite(selected, camera)
+            with profiler.section("composite"):
+                for rect in rects:
+                    surface.set_clip(rect)
+                    surface.blit(below, rect, rect)
+                    if sprite is not None:
+                        surface.blit(sprite, position)
+                    surface.blit(above, rect, rect, special_flags = pygame.BLEND_PREMULTIPLIED)
+                surface.set_clip(None)
+            return
+
+        drawn = set()
+        for rect in rects:
+            with profiler.section("cull"):
+                visible = self.visibleObjects(camera.sceneRect(rect))
+            with profiler.section("sprites"):
+                sprites = [self.getSprite(n, camera) for n in visible]
+            with profiler.section("composite"):
+                surface.set_clip(rect)
+                surface.fill(pygame.Color(self.background), rect)
+                for sprite, position in sprites:
+                    surface.blit(sprite, position)
+            drawn.update(visible)
+        surface.set_clip(None)
+        self.drawn = len(drawn)
+        self.culled = len(self.store) - self.drawn
+
+    def displayNative(self, surface, rects, selected, camera):
+        """ 
+            Draws the scene at zoom 1 on a surface kept between frames, then scales 
+            the regions drawn up to surface: the sprites are never needed zoomed
+            The positions on screen are multiples of the zoom, the pixels are the same
+        """
+        zoom = camera.zoom
+        size = (-(-surface.get_width() // zoom), -(-surface.get_height() // zoom))
+        if self.native_surface is None or self.native_surface.get_size() != size:
+            self.native_surface = pygame.Surface(size, 0, surface)
+            rects = None # Nothing was drawn on it yet
+        native_camera = Camera(camera.x, camera.y)
+        native_rects = None
+        if rects is not None:
+            # The regions of the native surface covering the regions of the screen
+            native_rects = [camera.sceneRect(rect).move(-camera.x, -camera.y).clip(self.native_surface.get_rect())
+                for rect in rects]
+        self.displayOn(self.native_surface, native_rects, selected, native_camera)
+        with self.profiler.section("upscale"):
+            for rect in native_rects or [self.native_surface.get_rect()]:
+                if rect.w and rect.h:
+                    scaled = pygame.transform.scale(self.native_surface.subsurface(rect), (rect.w * zoom, rect.h * zoom))
+                    surface.blit(scaled, (rect.x * zoom, rect.y * zoom))
+
+    def visibleObjects(self, rect):
+        """ Objects overlapping rect, a rect of the scene, in the order they are drawn """
+        order = self.objectsOrder()
+        return sorted(order[key] for key in self.spatialIndex().queryRect(rect))
+
+    def bake(self, selected, camera, size):
+        """
+            Composites the objects below the selected one, background included,
+            and the objects above it into two surfaces of the given size, kept 
+            until an edit touches them or the camera moves
+            The upper layer is premultiplied so that it stacks like the objects it holds,
+            the sprites without per-pixel alpha are the same premultiplied or not
+        """
+        key = (self.store.key(selected), camera.state(), tuple(size))
+        if self.baked is None or self.baked[0] != key:
+            visible = self.visibleObjects(camera.sceneRect(Rect((0, 0), size)))
+            below = pygame.Surface(size)
+            below.fill(pygame.Color(self.background))
+            above = pygame.Surface(size, pygame.SRCALPHA)
+            for n in visible:
+                if n == selected:
+                    continue
+                sprite, position = self.getSprite(n, camera)
+                if n < selected:
+                    below.blit(sprite, position)
+                elif not sprite.get_flags() & pygame.SRCALPHA:
+                    above.blit(sprite, position)
+                else:
+                    above.blit(sprite.premul_alpha(), position, special_flags = pygame.BLEND_PREMULTIPLIED)
+            self.baked = (key, below, above)
+            self.drawn = len(visible)
+            self.culled = len(self.store) - self.drawn
+        return self.baked
+
+    def checkSprites(self):
+        """ Forgets the object sizes if sprites were added, removed or changed on disk """
+        if self.sprites.poll() or self.cache.reloads != self.cache_reloads:
+            self.cache_reloads = self.cache.reloads
+            self.grid = None
+            self.damage_all = True
+            self.baked = None
+
+    def damaged(self, n, layers = False):
+        """ 
+            The region covered by object n must be drawn again
+            layers tells that the objects order changed, the baked layers are then outdated
+        """
+        if layers or (self.baked is not None and self.baked[0][0] != self.store.key(n)):
+            self.baked = None
+        if self.damage_all:
+            return
+        rect = self.spriteRect(n)
+        if rect is not None:
+            self.damage.append(rect)
+            if len(self.damage) > MAX_DAMAGE:
+                self.damage_all = True
+                self.damage = []
+
+    def takeDamage(self):
+        """ 
+            Returns the regions changed since the last call, merged together
+            None means that the whole scene changed
+        """
+        self.checkSprites()
+        damage_all, damage = self.damage_all, self.damage
+        self.damage_all = False
+        self.damage = []
+        if damage_all:
+            return None
+        return mergeRects(damage)
+
+    def getImage(self, sprite_name, zoom = 1):
+        """ The sprite, trimmed of its transparent borders by the cache """
+        return self.fromCache(self.cache.get, sprite_name, zoom)
+
+    def getSprite(self, n, camera):
+        """ The sprite of object n as seen through camera, and its position on screen """
+        sprite_name = self.store.name(n)
+        sprite = self.getImage(sprite_name, camera.zoom)
+        if sprite is None:
+            return None, None
+        (dx, dy), size = self.cache.trimOf(sprite_name, self.scale * camera.zoom)
+        x, y = camera.toScreen(self.store.pos(n))
+        return sprite, (x + dx, y + dy)
+
+    def spriteRect(self, n):
+        """ Rect of the pixels of object n left by the trim, None if its sprite is missing """
+        sprite_name = self.store.name(n)
+        sprite = self.getImage(sprite_name)
+        if sprite is None:
+            return None
+        (dx, dy), size = self.cache.trimOf(sprite_name, self.scale)
+        x, y = self.store.pos(n)
+        return Rect((x + dx, y + dy), sprite.get_size())
+
+    def getMask(self, sprite_name):
+        return self.fromCache(self.cache.getMask, sprite_name)
+
+    def fromCache(self, getter, sprite_name, zoom = 1):
+        path = self.sprites.find(sprite_name)
+        if path is None:
+            return None
+        try:
+            return getter(sprite_name, path, self.scale * zoom, self.sprites.loadImage)
+        except (IOError, OSError):
+            # The sprite was moved or deleted: look for it again
+            self.sprites.poll(force = True)
+            path = self.sprites.find(sprite_name)
+            if path is None:
+                return None
+            return getter(sprite_name, path, self.scale * zoom, self.sprites.loadImage)
+
     def listAllImages(self):
-        import os
-        import glob
-        imgs = []
-        for dirpath, dirnames, filenames in os.walk(self.sprites_dir):
-            imgs.extend(map(os.path.basename, glob.glob(os.path.join(dirpath, "*.[pP][nN][gG]"))))
-        return imgs
+        return list(self.sprites.names)
         
     def objectAt(self, pos):
-        from pygame import Rect
-        for (rn, (s, p)) in enumerate(self.objects[::-1]):
-            img = self.getImage(s)
-            n = len(self.objects) - 1 - rn
-            if Rect(p, img.get_size()).collidepoint(pos) and img.get_at(self.distToObject(n, pos)).a > 0:
-                print("Found sprite {0}: {1}".format(n, self.objects[n][0]))
+        order = self.objectsOrder()
+        candidates = self.spatialIndex().queryPoint(pos)
+        # The objects drawn last are on top
+        for n in sorted((order[key] for key in candidates), reverse = True):
+            mask = self.getMask(self.store.name(n))
+            if mask is None:
+                continue
+            # The mask is the one of the trimmed sprite
+            (dx, dy), size = self.cache.trimOf(self.store.name(n), self.scale)
+            x, y = self.distToObject(n, pos)
+            if mask.get_at((x - dx, y - dy)):
+                print("Found sprite {0}: {1}".format(n, self.store.name(n)))
                 return n
         return None
+
+    def spatialIndex(self):
+        """ Grid of the object rects, built on first use then kept up to date by the edits """
+        if self.grid is None or self.grid_scale != self.scale:
+            self.grid = SpatialGrid()
+            self.grid_scale = self.scale
+            for n in range(len(self.store)):
+                self.indexObject(n)
+        return self.grid
+
+    def indexObject(self, n):
+        """ Updates the rect of object n in the grid, if the grid is built """
+        if self.grid is None:
+            return
+        rect = self.spriteRect(n)
+        if rect is None:
+            self.grid.remove(self.store.key(n))
+        else:
+            self.grid.move(self.store.key(n), rect)
+
+    def unindexObject(self, n):
+        if self.grid is not None:
+            self.grid.remove(self.store.key(n))
+        self.order = None
+
+    def objectsOrder(self):
+        """ Position in the objects list of each object key, rebuilt after z-order changes """
+        if self.order is None:
+            self.order = self.store.order()
+        return self.order
     
     def distToObject(self, object, pos):
-        xo, yo = self.objects[object][1]
+        xo, yo = self.store.pos(object)
         return pos[0] - xo, pos[1] - yo
         
     def moveObject(self, object, to):
-        self.objects[object][1] = to
+        if tuple(self.store.pos(object)) == tuple(to):
+            return
+        self.damaged(object)
+        self.store.setPos(object, to)
+        self.indexObject(object)
+        self.damaged(object)
+        self.logEdit("move", object, to[0], to[1])
     
     def deleteObject(self, object):
-        del self.objects[object]
+        self.damaged(object, layers = True)
+        self.unindexObject(object)
+        self.store.delete(object)
+        self.logEdit("delete", object)
     
     def copyObject(self, n):
-        import copy
-        newobject = copy.deepcopy(self.objects[n])
-        self.objects.insert(n + 1, newobject)
+        self.store.copy(n)
+        self.indexObject(n + 1)
+        self.damaged(n + 1, layers = True)
+        self.order = None
+        self.logEdit("copy", n)
         return n + 1
     
     def putToBackground(self, n):
-        ob = self.objects[n]
-        del self.objects[n]
-        self.objects.insert(0, ob)
+        self.store.moveTo(n, 0)
+        self.damaged(0, layers = True)
+        self.order = None
+        self.logEdit("background", n)
         return 0
         
     def putToForeground(self, n):
-        ob = self.objects[n]
-        del self.objects[n]
-        self.objects.append(ob)
-        return len(self.objects) - 1
+        self.store.moveTo(n, len(self.store) - 1)
+        self.damaged(len(self.store) - 1, layers = True)
+        self.order = None
+        self.logEdit("foreground", n)
+        return len(self.store) - 1
     
     def changeToNextImage(self, n):
-        ob = self.objects[n]
-        imgs = list(self.listAllImages())
-        cur_img = imgs.index(ob[0])
-        ob[0] = imgs[(cur_img + 1)%len(imgs)]        
+        self.setObjectImage(n, self.sprites.next(self.store.name(n)))
         
     def changeToPreviousImage(self, n):
-        ob = self.objects[n]
-        imgs = list(self.listAllImages())
-        cur_img = imgs.index(ob[0])
-        ob[0] = imgs[(cur_img - 1)%len(imgs)]
+        self.setObjectImage(n, self.sprites.previous(self.store.name(n)))
+
+    def setObjectImage(self, n, sprite_name):
+        self.damaged(n)
+        self.store.setName(n, sprite_name)
+        self.indexObject(n)
+        self.damaged(n)
+        self.logEdit("image", n, sprite_name)
     
-    def addNewObject(self, pos):
-        self.objects.append([self.listAllImages()[0], pos])
-        return len(self.objects) - 1                
+    def addNewObject(self, pos, sprite_name = None):
+        if sprite_name is None:
+            sprite_name = self.sprites.names[0]
+        self.store.append(sprite_name, pos)
+        n = len(self.store) - 1
+        self.logEdit("add", sprite_name, pos[0], pos[1])
+        self.indexObject(n)
+        self.damaged(n)
+        if self.order is not None:
+            self.order[self.store.key(n)] = n
+        return n
     
     def getObjectRect(self, n):
-        ob, pos = self.objects[n]
-        return Rect(pos, self.getImage(ob).get_size())
+        """ Rect of the whole sprite of object n, transparent borders included """
+        self.getImage(self.store.name(n))
+        offset, size = self.cache.trimOf(self.store.name(n), self.scale)
+        return Rect(self.store.pos(n), size)
         
-    def saveToFile(self):
+    def spriteNames(self):
+        """ Names of the sprites used by the objects """
+        return self.store.spriteNames()
+
+    def saveToFile(self, background = True):
+        """
+            Saves the scene, in a thread with background so that the editor does not wait
+            The objects are copied first, the edits made during the save are kept for the next one
+        """
+        edits = self.journal.mark() if self.journal is not None else 0
+        data = dict((key, value) for key, value in self.scene.items() if key != "objects")
+        data["edits"] = edits
+        store = self.store.snapshot()
+        index = self.sprites.snapshot()
+        if not background:
+            self.writeScene(data, store, edits, index)
+            self.save_error = None
+            return None
+        self.saving = self.onSaver(self.writeScene, data, store, edits, index)
+        self.saving.add_done_callback(self.saveDone)
+        return self.saving
+
+    def onSaver(self, task, *args):
+        """ Runs task on the thread of the saves, one task after the other """
+        if self.saver is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.saver = ThreadPoolExecutor(1)
+        return self.saver.submit(task, *args)
+
+    def saveDone(self, future):
+        """ Reports a background save that failed, its edits are still in the journal """
+        if future.cancelled():
+            return
+        self.save_error = future.exception()
+        if self.save_error is not None:
+            print("Could not save {0}: {1}".format(self.scene_file, self.save_error))
+
+    def writeScene(self, data, store, edits, index = None):
+        """ Writes a copy of the scene made by saveToFile, then forgets the edits it holds """
         import json
-        f = open(self.scene_file, "w")
-        # Indent = 0 => "pretty" print (newlines)
-        json.dump(self.scene, f, indent=0)
-        print("Scene saved to {0}".format(self.scene_file)) 
+        if isBinary(self.scene_file):
+            if not isinstance(store, ColumnStore):
+                store = ColumnStore.fromList(store.toList())
+            saveBinary(self.scene_file, data, store)
+        else:
+            # Indent = 0 => "pretty" print (newlines)
+            atomicWrite(self.scene_file, lambda f: json.dump(dict(data, objects = store.toList()), f, indent=0))
+        print("Scene saved to {0}".format(self.scene_file))
+        # The scene holds the edits now: the journal and the index failing do not undo the save
+        if index is not None:
+            try:
+                self.sprites.save(self.indexFile(), index)
+            except (IOError, OSError) as e:
+                print("Could not save the sprite index {0}: {1}".format(self.indexFile(), e))
+        if self.journal is not None:
+            # The edits up to the save are written before compact drops them
+            try:
+                self.journal.flush()
+            except (IOError, OSError) as e:
+                print("Could not write the journal {0}: {1}".format(self.journalFile(), e))
+            else:
+                self.journal.compact(edits)
+
+    def logEdit(self, *op):
+        """ Notes an edit in the journal, unless it is being replayed """
+        journal = self.__dict__.get("journal")
+        if journal is not None and not self.replaying:
+            journal.record(op)
+
+    def replay(self):
+        """ Opens the journal of the scene file and makes again the edits not saved yet """
+        saved = self.scene.get("edits", 0)
+        self.journal = Journal(self.journalFile(), saved)
+        edits = self.journal.read(saved)
+        self.replaying = True
+        try:
+            for n, op in edits:
+                name, args = op[0], op[1:]
+                if name == "move":
+                    self.moveObject(args[0], args[1:])
+                elif name == "delete":
+                    self.deleteObject(*args)
+                elif name == "copy":
+                    self.copyObject(*args)
+                elif name == "background":
+                    self.putToBackground(*args)
+                elif name == "foreground":
+                    self.putToForeground(*args)
+                elif name == "image":
+                    self.setObjectImage(*args)
+                elif name == "add":
+                    self.addNewObject(args[1:], args[0])
+                elif name == "set":
+                    setattr(self, *args)
+        except (IndexError, TypeError, ValueError) as e:
+            print("Journal {0} does not match the scene, replay stopped: {1}".format(self.journalFile(), e))
+        finally:
+            self.replaying = False
+        if edits:
+            print("{0} edits replayed from {1}".format(len(edits), self.journalFile()))
+
+    def autosave(self):
+        """ 
+            Writes the journal at most every AUTOSAVE_INTERVAL
+            A journal too long is merged into the scene file by a background save
+        """
+        if self.journal is None or time.time() - self.last_autosave < AUTOSAVE_INTERVAL:
+            return
+        self.last_autosave = time.time()
+        # The journal is written and synced on the thread of the saves, once at a time
+        if self.flushing is None or self.flushing.done():
+            self.flushing = self.onSaver(self.journal.flush)
+            self.flushing.add_done_callback(self.flushDone)
+        # After a failed save, the journal keeps the edits: an explicit save retries
+        if self.save_error is None and self.journal.count > COMPACT_EDITS and (self.saving is None or self.saving.done()):
+            self.saveToFile()
+
+    def flushDone(self, future):
+        """ Reports a journal that could not be written """
+        if not future.cancelled() and future.exception() is not None:
+            print("Could not write the journal {0}: {1}".format(self.journalFile(), future.exception()))
+
+    def close(self):
+        """ Writes the edits not written yet and waits for the saves in progress """
+        if self.journal is not None:
+            self.journal.flush()
+        if self.saver is not None:
+            self.saver.shutdown(wait = True)
+            self.saver = None
+        if self.save_error is not None:
+            print("The last save of {0} failed, its edits are kept in {1}".format(self.scene_file, self.journalFile()))
+
+    def useObjects(self, objects, columnar = False):
+        """ Takes objects, a JSON objects list or a ColumnStore, as the objects of the scene """
+        if isinstance(objects, ColumnStore):
+            store = objects
+        elif columnar:
+            store = ColumnStore.fromList(objects)
+        else:
+            store = ListStore(objects)
+        self.scene["objects"] = objects if isinstance(store, ListStore) else store
+        self.__dict__["store"] = store
+        self.__dict__["grid"] = None
+        self.__dict__["order"] = None
+
+    def indexFile(self):
+        """ The sprites index is saved next to the scene file """
+        return self.scene_file + ".sprites"
+
+    def journalFile(self):
+        return self.scene_file + ".journal"
     
     def __getattr__(self, name):
         if name in Scene.file_data.keys():
@@ -153,14 +641,26 @@ class Scene:
         
     def __setattr__(self, name, value):
         if name in Scene.file_data.keys():
-            self.scene[name] = value
+            if name == "objects":
+                self.useObjects(value, isinstance(self.store, ColumnStore))
+            else:
+                self.scene[name] = value
+                self.logEdit("set", name, value)
+            # Scale, background, resolution or objects changed: everything is to redraw
+            self.__dict__["damage_all"] = True
+            self.__dict__["baked"] = None
         else:
             self.__dict__[name] = value
         
+# Rendering modes of SceneCreator
+FULL_REDRAW = "full"
+DIRTY_RECTS = "dirty"
+
 class SceneCreator:
-    def __init__(self, scene):
+    def __init__(self, scene, render_mode = DIRTY_RECTS, trace_file = None):
         """
             Lance l'application SceneCreator sur la scène donnée
+            Avec trace_file, le temps passé dans chaque étape de l'affichage y est enregistré
         """
         self.scene = scene
         self.screen = pygame.display.set_mode(scene.resolution, pygame.RESIZABLE)
@@ -169,39 +669,101 @@ class SceneCreator:
         self.selected_sprite = None
         self.delta_selected = [0, 0]
         
+        # In dirty rects mode, only the regions which changed are drawn again
+        self.render_mode = render_mode
+        self.last_selection = None
+        self.redrawn_pixels = 0
+        
+        # Part of the scene shown in the window, moved with the middle button and the wheel
+        self.camera = Camera()
+        self.last_camera = None
+        self.panning = None
+        
+        # F3 shows where the time of each frame goes
+        self.profiler = FrameProfiler(trace_file)
+        self.scene.profiler = self.profiler
+        self.last_overlay = None
+        
         self.status_bar_font = pygame.font.SysFont("arial", 12)
         
         self.quit = False
         while not self.quit:
-            self.events()
+            self.profiler.beginFrame()
+            with self.profiler.section("events"):
+                self.events()
             self.refresh()
+            self.profiler.endFrame()
+        self.scene.close()
+        self.profiler.close()
+        print(self.scene.cache.trimReport())
+        print(self.scene.cache.formatReport(self.screen))
     
     def refresh(self):
-        self.scene.displayOn(self.screen)
+        profiler = self.profiler
+        with profiler.section("reload"):
+            damage = self.scene.takeDamage()
+        if self.camera.state() != self.last_camera:
+            damage = None # Everything moved on screen
+            self.last_camera = self.camera.state()
+        selection = None
         if not self.selected_sprite is None:
-            pygame.draw.rect(self.screen, pygame.Color("Red"), 
-                self.scene.getObjectRect(self.selected_sprite), 1)
-        self.refreshStatusBar()
-                
-        pygame.display.flip()
-        self.clock_fps.tick(60)
+            with profiler.section("sprites"):
+                selection = self.camera.screenRect(self.scene.getObjectRect(self.selected_sprite))
+
+        if self.render_mode == FULL_REDRAW or damage is None:
+            self.scene.displayOn(self.screen, selected = self.selected_sprite, camera = self.camera)
+            self.drawSelection(selection)
+            with profiler.section("status bar"):
+                self.refreshStatusBar()
+                overlay = profiler.drawOverlay(self.screen)
+            with profiler.section("flip"):
+                pygame.display.flip()
+            self.redrawn_pixels = self.screen.get_width() * self.screen.get_height()
+        else:
+            damage = [self.camera.screenRect(rect) for rect in damage]
+            # The selection frame and the overlay of the last frame must be erased
+            for rect in (self.last_selection, selection, self.last_overlay):
+                if rect is not None:
+                    damage.append(rect)
+            damage = [rect.clip(self.screen.get_rect()) for rect in mergeRects(damage)]
+            self.scene.displayOn(self.screen, damage, self.selected_sprite, self.camera)
+            self.drawSelection(selection)
+            with profiler.section("status bar"):
+                self.refreshStatusBar()
+                overlay = profiler.drawOverlay(self.screen)
+            with profiler.section("flip"):
+                pygame.display.update(damage + [self.status_bar_rect] + ([overlay] if overlay else []))
+            self.redrawn_pixels = sum(rect.w * rect.h for rect in damage)
+        self.last_selection = selection
+        self.last_overlay = overlay
+
+        with profiler.section("autosave"):
+            self.scene.autosave()
+        with profiler.section("wait"):
+            self.clock_fps.tick(60)
         pygame.display.set_caption("SceneCreator v{0}".format(
             __version__, self.clock_fps.get_fps()))
 
+    def drawSelection(self, selection):
+        if not selection is None:
+            pygame.draw.rect(self.screen, pygame.Color("Red"), selection, 1)
+
     def refreshStatusBar(self):
         BAR_HEIGHT = 20
         self.status_bar = pygame.Surface((self.screen.get_width(), BAR_HEIGHT))
         self.status_bar.fill(Color("lightgray"))
         status_bar_text = self.status_bar_font.render(
-        "{}    {}x{}    {}, {}    {:.4} FPS".format(
+        "{}    {}x{}    {}, {}    x{}    {:.4} FPS    {} px redrawn ({})    {} drawn, {} culled".format(
             self.scene.scene_file, 
             self.screen.get_width(), self.screen.get_height(),
-            pygame.mouse.get_pos()[0], pygame.mouse.get_pos()[1],
-            self.clock_fps.get_fps()),
+            *self.camera.toScene(pygame.mouse.get_pos()), self.camera.zoom,
+            self.clock_fps.get_fps(), self.redrawn_pixels, 
+            self.render_mode + (", native" if self.scene.native else ""),
+            self.scene.drawn, self.scene.culled),
             True, # With antialiasing
             Color("black"))
         self.status_bar.blit(status_bar_text, (5, 2))
-        self.screen.blit(self.status_bar, (0, self.screen.get_height() - BAR_HEIGHT))
+        self.status_bar_rect = self.screen.blit(self.status_bar, (0, self.screen.get_height() - BAR_HEIGHT))
         
     def events(self):
         for event in pygame.event.get():
@@ -210,17 +772,32 @@ class SceneCreator:
             elif event.type == VIDEORESIZE:
                 self.scene.resolution = event.size
                 pygame.display.set_mode(event.size, pygame.RESIZABLE)
+            elif event.type == MOUSEBUTTONDOWN:
+                if event.button == 2:
+                    self.panning = (event.pos, self.camera.x, self.camera.y)
+                elif event.button == 4:
+                    self.camera.zoomAt(event.pos, self.camera.zoom + 1)
+                elif event.button == 5:
+                    self.camera.zoomAt(event.pos, self.camera.zoom - 1)
             elif event.type == MOUSEBUTTONUP:
                 if event.button == 1:
                     self.selectAtPosition(event.pos)
+                elif event.button == 2:
+                    self.panning = None
                 elif event.button == 3:
                     self.deleteAtPosition(event.pos)
+            elif event.type == MOUSEMOTION:
+                if not self.panning is None:
+                    (x, y), camera_x, camera_y = self.panning
+                    self.camera.x = camera_x - (event.pos[0] - x) // self.camera.zoom
+                    self.camera.y = camera_y - (event.pos[1] - y) // self.camera.zoom
             elif event.type == KEYDOWN:
                 self.keyDownEvent(event.unicode, event.key, event.mod)
         
         if not self.selected_sprite is None:
-            new_pos_x = pygame.mouse.get_pos()[0] - self.delta_selected[0]
-            new_pos_y = pygame.mouse.get_pos()[1] - self.delta_selected[1]
+            mouse_pos = self.camera.toScene(pygame.mouse.get_pos())
+            new_pos_x = mouse_pos[0] - self.delta_selected[0]
+            new_pos_y = mouse_pos[1] - self.delta_selected[1]
             self.scene.moveObject(self.selected_sprite, (new_pos_x, new_pos_y))            
     
     def keyDownEvent(self, unicode, key, mods):
@@ -247,7 +824,7 @@ class SceneCreator:
         elif key == K_DELETE:
             self.deleteAtPosition(pygame.mouse.get_pos())
         elif key == K_SPACE:
-            self.selected_sprite = self.scene.addNewObject(pygame.mouse.get_pos())
+            self.selected_sprite = self.scene.addNewObject(self.camera.toScene(pygame.mouse.get_pos()))
             self.delta_selected = [0, 0]
         elif key == K_PAGEDOWN:
             if self.scene.scale > 1:
@@ -256,28 +833,47 @@ class SceneCreator:
             self.scene.scale += 1
         elif key == K_RIGHT:
             pos = pygame.mouse.get_pos()
-            move = self.scene.scale
+            move = self.scene.scale * self.camera.zoom
             if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                  move *= 10
             pygame.mouse.set_pos((pos[0] + move, pos[1]))
         elif key == K_LEFT:
             pos = pygame.mouse.get_pos()
-            move = self.scene.scale
+            move = self.scene.scale * self.camera.zoom
             if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                  move *= 10
             pygame.mouse.set_pos((pos[0] - move, pos[1]))
         elif key == K_UP:
             pos = pygame.mouse.get_pos()
-            move = self.scene.scale
+            move = self.scene.scale * self.camera.zoom
             if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                  move *= 10
             pygame.mouse.set_pos((pos[0], pos[1] - move))
         elif key == K_DOWN:
             pos = pygame.mouse.get_pos()
-            move = self.scene.scale
+            move = self.scene.scale * self.camera.zoom
             if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                  move *= 10
             pygame.mouse.set_pos((pos[0], pos[1] + move))
+        elif key == K_d:
+            # Switches between dirty rects and full redraw
+            if self.render_mode == DIRTY_RECTS:
+                self.render_mode = FULL_REDRAW
+            else:
+                self.render_mode = DIRTY_RECTS
+                self.scene.damage_all = True
+        elif key == K_KP_PLUS:
+            self.camera.zoomAt(pygame.mouse.get_pos(), self.camera.zoom + 1)
+        elif key == K_KP_MINUS:
+            self.camera.zoomAt(pygame.mouse.get_pos(), self.camera.zoom - 1)
+        elif key == K_HOME:
+            self.camera = Camera()
+        elif key == K_F3:
+            self.profiler.toggle()
+        elif key == K_n:
+            # Switches between drawing zoomed sprites and scaling up the scene drawn at zoom 1
+            self.scene.native = not self.scene.native
+            self.scene.damage_all = True
         elif key == K_F4:
             if pygame.key.get_mods() & KMOD_ALT:
                 self.quit = True
@@ -292,6 +888,7 @@ class SceneCreator:
             print("Sprite {0} deselected".format(self.selected_sprite))
             self.selected_sprite = None
         else:
+            pos = self.camera.toScene(pos)
             self.selected_sprite = self.scene.objectAt(pos)
             if not self.selected_sprite is None:                 
                 self.delta_selected = self.scene.distToObject(self.selected_sprite, pos)
@@ -299,17 +896,21 @@ class SceneCreator:
                 
     def deleteAtPosition(self, pos):
         """ Selects and delete the sprite at the given position """            
-        self.selected_sprite = self.scene.objectAt(pos) 
+        self.selected_sprite = self.scene.objectAt(self.camera.toScene(pos)) 
         if not self.selected_sprite is None:
             self.scene.deleteObject(self.selected_sprite)
             self.selected_sprite = None
                     
 if __name__ == "__main__":
-    import sys
+    import argparse
+    from surfaceformat import addPaletteOption
+    parser = argparse.ArgumentParser(description = "Prototypes scenes from a set of sprites")
+    parser.add_argument("sprites_dir", nargs = "?", default = ".", help = "directory or atlas manifest of the sprites")
+    parser.add_argument("scene_file", nargs = "?", default = None, help = "scene to create or edit")
+    parser.add_argument("--trace", default = None, help = "file to write a Chrome trace of the frames to")
+    addPaletteOption(parser)
+    options = parser.parse_args()
     pygame.init()
-    if len(sys.argv) > 1:
-        scene = Scene(*sys.argv[1:])
-    else:
-        scene = Scene()
+    scene = Scene(options.sprites_dir, options.scene_file, SpriteCache(palette = options.palette))
     
-    SceneCreator(scene)
\ No newline at end of file
+    SceneCreator(scene, trace_file = options.trace)
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import json
+import threading
+
+"""
+    SceneJournal
+
+    SceneJournal fait partie de la suite logicielle FreeGameTools, il note
+    les modifications faites à une scène entre deux sauvegardes, pour ne
+    pas avoir à réécrire toute la scène après chaque modification.
+
+    Le journal est un fichier texte à côté de la scène, une opération par
+    ligne, en JSON. Il est rejoué à l'ouverture de la scène.
+
+    SceneJournal is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+class Journal:
+    """
+        Append-only file of the edits made to a scene
+
+        Each edit is written as a JSON list [number, operation, arguments...],
+        the edits are numbered in the order they were made. The scene file
+        remembers the number of the last edit it holds, so that the edits it
+        already holds are not replayed if the journal could not be compacted.
+        Consecutive moves of the same object are written as one move.
+    """
+    def __init__(self, filename, seq = 0):
+        self.filename = filename
+        # Edits recorded but not written yet, as (number, operation)
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        # Held while the file is written, flush and compact can run on another thread
+        self.lock = threading.Lock()
+        # Number of the last edit written, and number of edits in the file
+        self.seq = seq
+        self.count = 0
+        for n, op in self.read():
+            self.seq = max(self.seq, n)
+            self.count += 1
+        # Number of the last edit recorded, and of the last one given by mark
+        self.last = self.seq
+        self.marked = self.seq
+
+    def read(self, after = 0):
+        """ Edits of the file numbered after after, as (number, operation) """
+        edits = []
+        last = 0
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    try:
+                        edit = json.loads(line)
+                    except ValueError:
+                        continue # A line cut by a crash or a failed flush, flush ended it
+                    # The edits written again after a failed flush are only read once
+                    if edit[0] > last:
+                        last = edit[0]
+                        if edit[0] > after:
+                            edits.append((edit[0], edit[1:]))
+        except IOError:
+            pass # No journal: nothing was edited since the last save
+        return edits
+
+    def record(self, op):
+        """ Adds an edit, written by the next flush """
+        with self.pending_lock:
+            # A move is not merged into an edit already given by mark: the save holds that one
+            if (op[0] == "move" and self.pending and self.pending[-1][0] > self.marked
+                    and self.pending[-1][1][:2] == op[:2]):
+                self.pending[-1] = (self.pending[-1][0], op)
+            else:
+                self.last += 1
+                self.pending.append((self.last, op))
+
+    def flush(self):
+        """
+            Appends the pending edits to the file, returns True if there were some
+            If the file can not be written, the edits stay pending for the next flush.
+        """
+        with self.lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return False
+            lines = [json.dumps([n] + list(op)) + "\n" for n, op in pending]
+            text = "".join(lines).encode("utf-8")
+            try:
+                with open(self.filename, "ab+") as f:
+                    # The new edits do not go on the end of a cut line
+                    if f.tell() > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            text = b"\n" + text
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                with self.pending_lock:
+                    self.pending[:0] = pending
+                raise
+            self.seq = pending[-1][0]
+            self.count += len(lines)
+        return True
+
+    def mark(self):
+        """
+            Number of the last edit recorded, for a save of the scene as it is now
+            Nothing is written: the save flushes the journal on its own thread.
+        """
+        with self.pending_lock:
+            self.marked = self.last
+        return self.marked
+
+    def compact(self, seq):
+        """ Removes the edits up to seq, the scene file holds them now """
+        from scenestore import atomicWrite
+        with self.lock:
+            edits = self.read(seq)
+            if not edits:
+                try:
+                    os.remove(self.filename)
+                except OSError:
+                    pass
+            else:
+                atomicWrite(self.filename, lambda f: f.write(
+                    "".join(json.dumps([n] + op) + "\n" for n, op in edits)))
+            self.count = len(edits)
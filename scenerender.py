@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+
+"""
+    SceneRender
+
+    SceneRender fait partie de la suite logicielle FreeGameTools, il crée
+    sans fenêtre des aperçus PNG de scènes faites avec SceneCreator.
+
+    Utilisation: python scenerender.py -s sprites_dir -o output_dir scene_files...
+    Ou scene_files sont des fichiers de scène ou des motifs (scenes/*.json).
+    Seules les scènes modifiées depuis le dernier rendu sont rendues à nouveau.
+
+    SceneRender is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+__version__ = "0.1"
+
+# Name of the file remembering what was rendered, next to the PNG files
+MANIFEST = ".scenerender.json"
+
+# State of a worker process: the cache and the sprite indexes are shared by its scenes
+worker = {}
+
+def initWorker(sprites_dir, budget = None, palette = False):
+    """ Initialises pygame and the caches of a worker process, palette is given to the sprite cache """
+    from headless import initHeadless
+    initHeadless()
+    from spritecache import SpriteCache, DEFAULT_BUDGET
+    from scenecreator import openSprites
+    worker["cache"] = SpriteCache(DEFAULT_BUDGET if budget is None else budget, palette = palette)
+    worker["sprites"] = openSprites(sprites_dir)
+    worker["sprites_dir"] = sprites_dir
+
+def loadScene(scene_file):
+    """ Loads a scene with the caches of the worker """
+    from scenecreator import Scene
+    worker["sprites"].poll()
+    return Scene(worker["sprites_dir"], scene_file, worker["cache"], worker["sprites"])
+
+def sceneSprites(scene):
+    """ Sprites used by a scene, as [name, absolute path] in the order of the names """
+    sprites = []
+    for sprite_name in sorted(scene.spriteNames()):
+        path = scene.sprites.find(sprite_name)
+        sprites.append([sprite_name, None if path is None else os.path.abspath(path)])
+    return sprites
+
+def filesSignature(scene_file, sprites):
+    """ Hash of the modification times of the scene file, its journal and the sprites, as [name, path] """
+    mtimes = []
+    for sprite_name, path in sprites:
+        try:
+            mtime = None if path is None else os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        mtimes.append((sprite_name, path, mtime))
+    journal = scene_file + ".journal"
+    journal_mtime = os.path.getmtime(journal) if os.path.exists(journal) else None
+    signature = json.dumps([os.path.getmtime(scene_file), journal_mtime, mtimes])
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+def sceneSignature(scene_file, scene):
+    """ Hash of what the rendering depends on: the scene file, its journal and the sprites it uses """
+    return filesSignature(scene_file, sceneSprites(scene))
+
+def renderScene(scene_file, output_file, last = None):
+    """
+        Renders a scene to a PNG file, unless it did not change since last
+        last is the entry of the manifest: {"signature": ..., "sprites": [[name, path]...]}
+        Returns (scene_file, new entry, True if the scene was rendered)
+    """
+    import pygame
+    # The files of the last rendering are checked first: an unchanged scene is not even loaded
+    # A sprite that was missing is looked for again by loading the scene
+    if (isinstance(last, dict) and os.path.exists(output_file)
+            and all(path is not None for sprite_name, path in last["sprites"])
+            and filesSignature(scene_file, last["sprites"]) == last["signature"]):
+        return scene_file, last, False
+    scene = loadScene(scene_file)
+    sprites = sceneSprites(scene)
+    entry = {"signature" : filesSignature(scene_file, sprites), "sprites" : sprites}
+    if isinstance(last, dict) and entry["signature"] == last["signature"] and os.path.exists(output_file):
+        return scene_file, entry, False
+    surface = pygame.Surface(scene.resolution)
+    scene.displayOn(surface)
+    pygame.image.save(surface, output_file)
+    return scene_file, entry, True
+
+def outputFile(scene_file, output_dir):
+    name = os.path.splitext(os.path.basename(scene_file))[0] + ".png"
+    return os.path.join(output_dir or os.path.dirname(scene_file), name)
+
+def manifestFile(scene_file, output_dir):
+    """ Manifest of the directory the scene is rendered to, whatever the current directory """
+    return os.path.join(os.path.dirname(outputFile(scene_file, output_dir)), MANIFEST)
+
+def findScenes(patterns):
+    """ Scene files matching the given files or patterns, in order and without duplicates """
+    found = []
+    for pattern in patterns:
+        for scene_file in sorted(glob.glob(pattern)) or [pattern]:
+            if not scene_file in found:
+                found.append(scene_file)
+    return found
+
+def loadManifest(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def renderAll(scene_files, sprites_dir, output_dir = None, jobs = None, force = False, palette = False):
+    """
+        Renders the scenes on a pool of jobs processes
+        Returns the number of scenes rendered, skipped and failed
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    # {manifest file: {absolute scene file: entry returned by renderScene}}
+    manifests = {}
+    for scene_file in scene_files:
+        manifest_file = manifestFile(scene_file, output_dir)
+        if not manifest_file in manifests:
+            manifests[manifest_file] = loadManifest(manifest_file)
+    rendered = skipped = failed = 0
+
+    def done(scene_file, entry, was_rendered):
+        manifests[manifestFile(scene_file, output_dir)][os.path.abspath(scene_file)] = entry
+        return (1, 0) if was_rendered else (0, 1)
+
+    tasks = []
+    for scene_file in scene_files:
+        last = None if force else manifests[manifestFile(scene_file, output_dir)].get(os.path.abspath(scene_file))
+        tasks.append((scene_file, outputFile(scene_file, output_dir), last))
+    if jobs == 1: # Everything in this process, easier to debug
+        initWorker(sprites_dir, palette = palette)
+        for task in tasks:
+            try:
+                r, s = done(*renderScene(*task))
+                rendered, skipped = rendered + r, skipped + s
+            except Exception as e:
+                print("{0}: {1}".format(task[0], e))
+                failed += 1
+    else:
+        with ProcessPoolExecutor(jobs, initializer = initWorker, initargs = (sprites_dir, None, palette)) as pool:
+            futures = dict((pool.submit(renderScene, *task), task[0]) for task in tasks)
+            for future in as_completed(futures):
+                try:
+                    r, s = done(*future.result())
+                    rendered, skipped = rendered + r, skipped + s
+                except Exception as e:
+                    print("{0}: {1}".format(futures[future], e))
+                    failed += 1
+
+    for manifest_file, manifest in manifests.items():
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=0)
+    return rendered, skipped, failed
+
+def main(args = None):
+    import argparse
+    from surfaceformat import addPaletteOption
+    parser = argparse.ArgumentParser(description = "Renders SceneCreator scenes to PNG files")
+    parser.add_argument("scenes", nargs = "+", help = "scene files or patterns")
+    parser.add_argument("-s", "--sprites", default = ".", help = "directory or atlas manifest of the sprites")
+    parser.add_argument("-o", "--output", default = None,
+        help = "directory of the PNG files, next to the scenes by default")
+    parser.add_argument("-j", "--jobs", type = int, default = None,
+        help = "number of worker processes, one per CPU by default")
+    parser.add_argument("-f", "--force", action = "store_true",
+        help = "render the scenes even if they did not change")
+    addPaletteOption(parser)
+    options = parser.parse_args(args)
+
+    scene_files = findScenes(options.scenes)
+    if options.output:
+        os.makedirs(options.output, exist_ok = True)
+    start = time.time()
+    rendered, skipped, failed = renderAll(scene_files, options.sprites, options.output,
+        options.jobs, options.force, options.palette)
+    elapsed = time.time() - start
+    print("{0} scenes rendered, {1} unchanged, {2} failed in {3:.2f} s ({4:.1f} scenes/s)".format(
+        rendered, skipped, failed, elapsed, len(scene_files) / max(elapsed, 1e-6)))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
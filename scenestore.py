@@ -0,0 +1,397 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+"""
+    SceneStore
+
+    SceneStore fait partie de la suite logicielle FreeGameTools, il stocke
+    les objets des scènes de SceneCreator. Pour les très grandes scènes, les
+    objets sont rangés en colonnes (tableaux typés) et peuvent être
+    sauvegardés dans un format binaire compact.
+
+    Utilisation: python scenestore.py scene.json scene.scnb
+    Convertit une scène d'un format à l'autre, dans un sens ou dans l'autre.
+
+    SceneStore is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+# Extension of the binary scene files
+BINARY_EXTENSION = ".scnb"
+
+# Binary format: magic, then object count, sprite name count and size of the JSON metadata
+MAGIC = b"FGTSCN1\0"
+HEADER = struct.Struct("<8sIII")
+NAME_LENGTH = struct.Struct("<H")
+
+def isBinary(scene_file):
+    return scene_file.lower().endswith(BINARY_EXTENSION)
+
+def atomicWrite(filename, write, binary = False):
+    """
+        Writes a file through write(f), on a temporary file then renamed over filename
+        If anything goes wrong, the old file is left untouched
+    """
+    import tempfile
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except OSError: # New file: the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, temp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(filename)), 
+        prefix = "." + os.path.basename(filename), suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "wb" if binary else "w") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp, mode)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+def copyColumn(column):
+    """ Copies an array, or a memoryview on a memory-mapped file, into a new array """
+    if not isinstance(column, memoryview):
+        return column[:]
+    copy = array(column.format)
+    copy.frombytes(column.cast("B"))
+    return copy
+
+class ListStore:
+    """
+        Objects kept as the JSON list of [sprite_name, [x, y]] lists
+
+        Each object is known by the identity of its list, which does not
+        change when objects are inserted or removed before it.
+    """
+    def __init__(self, objects):
+        self.objects = objects
+
+    def __len__(self):
+        return len(self.objects)
+
+    def name(self, n):
+        return self.objects[n][0]
+
+    def pos(self, n):
+        return self.objects[n][1]
+
+    def key(self, n):
+        return id(self.objects[n])
+
+    def setName(self, n, name):
+        self.objects[n][0] = name
+
+    def setPos(self, n, pos):
+        self.objects[n][1] = pos
+
+    def insert(self, n, name, pos):
+        self.objects.insert(n, [name, list(pos)])
+
+    def append(self, name, pos):
+        self.objects.append([name, pos])
+
+    def copy(self, n):
+        """ Inserts a copy of object n just above it """
+        self.insert(n + 1, self.name(n), self.pos(n))
+
+    def delete(self, n):
+        del self.objects[n]
+
+    def moveTo(self, n, m):
+        """ Moves object n to position m of the drawing order """
+        self.objects.insert(m, self.objects.pop(n))
+
+    def order(self):
+        """ Position of each object key """
+        return dict((id(ob), n) for n, ob in enumerate(self.objects))
+
+    def spriteNames(self):
+        return set(ob[0] for ob in self.objects)
+
+    def toList(self):
+        return self.objects
+
+    def snapshot(self):
+        """ Copy of the objects, which later edits do not change """
+        return ListStore([[name, list(pos)] for name, pos in self.objects])
+
+class ObjectView:
+    """ An object of a ColumnStore, usable like a [sprite_name, [x, y]] list """
+    __slots__ = ("store", "n")
+
+    def __init__(self, store, n):
+        self.store = store
+        self.n = n
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        return (self.store.name(self.n), self.store.pos(self.n))[i]
+
+    def __setitem__(self, i, value):
+        if i == 0:
+            self.store.setName(self.n, value)
+        elif i == 1:
+            self.store.setPos(self.n, value)
+        else:
+            raise IndexError(i)
+
+    def __iter__(self):
+        return iter((self.store.name(self.n), self.store.pos(self.n)))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr([self.store.name(self.n), list(self.store.pos(self.n))])
+
+class ColumnStore:
+    """
+        Objects kept in typed arrays, one column per field
+
+        Sprite names are interned: the sprite column holds numbers in the
+        name table. The z order is the row order, as in the JSON list, so
+        that object n is row n and a z-order change is one move per column.
+        Each object has a number (uid) which stays the same when it moves.
+        The columns can be memoryviews over a memory-mapped file, they are
+        copied into arrays on the first edit.
+    """
+    def __init__(self, table = None, sprite = None, x = None, y = None):
+        self.table = [] if table is None else table
+        self.ids = dict((name, n) for n, name in enumerate(self.table))
+        self.sprite = array("I") if sprite is None else sprite
+        self.x = array("i") if x is None else x
+        self.y = array("i") if y is None else y
+        self.uid = array("Q", range(len(self.sprite)))
+        self.next_uid = len(self.sprite)
+        self.mapped = None
+
+    @classmethod
+    def fromList(cls, objects):
+        store = cls()
+        for name, pos in objects:
+            if int(pos[0]) != pos[0] or int(pos[1]) != pos[1]:
+                raise ValueError("Position {0} of {1} is not made of integers".format(pos, name))
+            store.insert(len(store), name, pos)
+        return store
+
+    def __len__(self):
+        return len(self.sprite)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [ObjectView(self, i) for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return ObjectView(self, n)
+
+    def __iter__(self):
+        return (ObjectView(self, n) for n in range(len(self)))
+
+    def intern(self, name):
+        sprite_id = self.ids.get(name)
+        if sprite_id is None:
+            sprite_id = len(self.table)
+            self.table.append(name)
+            self.ids[name] = sprite_id
+        return sprite_id
+
+    def writable(self):
+        """ Copies the memory-mapped columns into arrays before an edit """
+        if self.mapped is None:
+            return
+        self.sprite, self.x, self.y = [copyColumn(column) for column in (self.sprite, self.x, self.y)]
+        self.mapped.close()
+        self.mapped = None
+
+    def columns(self):
+        return (self.sprite, self.x, self.y, self.uid)
+
+    def name(self, n):
+        return self.table[self.sprite[n]]
+
+    def pos(self, n):
+        return (self.x[n], self.y[n])
+
+    def key(self, n):
+        return self.uid[n]
+
+    def setName(self, n, name):
+        self.writable()
+        self.sprite[n] = self.intern(name)
+
+    def setPos(self, n, pos):
+        self.writable()
+        self.x[n], self.y[n] = int(pos[0]), int(pos[1])
+
+    def insert(self, n, name, pos):
+        self.writable()
+        self.sprite.insert(n, self.intern(name))
+        self.x.insert(n, int(pos[0]))
+        self.y.insert(n, int(pos[1]))
+        self.uid.insert(n, self.next_uid)
+        self.next_uid += 1
+
+    def append(self, name, pos):
+        self.insert(len(self), name, pos)
+
+    def copy(self, n):
+        """ Inserts a copy of object n just above it """
+        self.insert(n + 1, self.name(n), self.pos(n))
+
+    def delete(self, n):
+        self.writable()
+        for column in self.columns():
+            del column[n]
+
+    def moveTo(self, n, m):
+        """ Moves object n to position m of the drawing order """
+        self.writable()
+        for column in self.columns():
+            value = column[n]
+            del column[n]
+            column.insert(m, value)
+
+    def order(self):
+        """ Position of each object key """
+        return dict(zip(self.uid, range(len(self))))
+
+    def spriteNames(self):
+        return set(self.table[sprite_id] for sprite_id in set(self.sprite))
+
+    def toList(self):
+        table = self.table
+        return [[table[s], [x, y]] for s, x, y in zip(self.sprite, self.x, self.y)]
+
+    def snapshot(self):
+        """ Copy of the objects, which later edits do not change """
+        return ColumnStore(list(self.table), *[copyColumn(column) for column in (self.sprite, self.x, self.y)])
+
+def saveBinary(filename, data, store):
+    """ Writes a scene: data holds the scene fields, store its objects """
+    # Only the sprite names still used are written
+    used = sorted(store.spriteNames())
+    ids = dict((name, n) for n, name in enumerate(used))
+    remap = array("I", (ids.get(name, 0) for name in store.table))
+    meta = json.dumps(dict((k, v) for k, v in data.items() if k != "objects")).encode("utf-8")
+    def write(f):
+        f.write(HEADER.pack(MAGIC, len(store), len(used), len(meta)))
+        f.write(meta)
+        for name in used:
+            encoded = name.encode("utf-8")
+            f.write(NAME_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+        # The columns start on a multiple of 4 bytes
+        f.write(b"\0" * (-f.tell() % 4))
+        columns = [array("I", (remap[s] for s in store.sprite)), copyColumn(store.x), copyColumn(store.y)]
+        for column in columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            f.write(column.tobytes())
+    atomicWrite(filename, write, binary = True)
+
+def loadBinary(filename):
+    """ Reads a scene written by saveBinary: returns its fields and a ColumnStore of its objects """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("{0} is empty".format(filename))
+        mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    magic, count, name_count, meta_size = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        mapped.close()
+        raise ValueError("{0} is not a binary scene file".format(filename))
+    offset = HEADER.size
+    data = json.loads(mapped[offset:offset + meta_size].decode("utf-8"))
+    offset += meta_size
+    table = []
+    for n in range(name_count):
+        (length,) = NAME_LENGTH.unpack_from(mapped, offset)
+        offset += NAME_LENGTH.size
+        table.append(mapped[offset:offset + length].decode("utf-8"))
+        offset += length
+    offset += -offset % 4
+
+    if sys.byteorder == "little":
+        # The columns are read in place from the file
+        view = memoryview(mapped)
+        columns = [view[offset + k * 4 * count:offset + (k + 1) * 4 * count].cast(code)
+            for k, code in enumerate("Iii")]
+    else:
+        columns = []
+        for k, code in enumerate("Iii"):
+            column = array(code)
+            column.frombytes(mapped[offset + k * 4 * count:offset + (k + 1) * 4 * count])
+            column.byteswap()
+            columns.append(column)
+    store = ColumnStore(table, *columns)
+    if sys.byteorder == "little":
+        store.mapped = MappedFile(mapped, view, columns)
+    else:
+        mapped.close()
+    return data, store
+
+class MappedFile:
+    """ A memory-mapped file and the views on it, released together """
+    def __init__(self, mapped, view, columns):
+        self.mapped = mapped
+        self.views = columns + [view]
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.mapped.close()
+
+def loadScene(scene_file):
+    """ Reads a scene file in either format: returns its fields and its objects list or store """
+    if isBinary(scene_file):
+        data, store = loadBinary(scene_file)
+        data["objects"] = store
+        return data
+    with open(scene_file, "r") as f:
+        return json.load(f)
+
+def main(args = None):
+    import argparse
+    parser = argparse.ArgumentParser(description = "Converts a scene between the JSON and the binary formats")
+    parser.add_argument("source", help = "scene file to read")
+    parser.add_argument("destination", help = "scene file to write, binary if it ends with " + BINARY_EXTENSION)
+    options = parser.parse_args(args)
+
+    data = loadScene(options.source)
+    objects = data["objects"] if "objects" in data else []
+    if isBinary(options.destination):
+        store = objects if isinstance(objects, ColumnStore) else ColumnStore.fromList(objects)
+        saveBinary(options.destination, data, store)
+    else:
+        if isinstance(objects, ColumnStore):
+            data["objects"] = objects.toList()
+        with open(options.destination, "w") as f:
+            json.dump(data, f, indent=0)
+    print("{0} objects written to {1}".format(len(objects), options.destination))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
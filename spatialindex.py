@@ -0,0 +1,114 @@
+import pygame
+
+"""
+    SpatialIndex
+
+    SpatialIndex fait partie de la suite logicielle FreeGameTools, il permet
+    de retrouver rapidement les objets présents à une position ou dans une
+    zone, sans parcourir tous les objets.
+
+    SpatialIndex is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+# Default size of the grid cells, in pixels
+CELL_SIZE = 128
+
+class SpatialGrid:
+    """
+        Uniform grid over the bounding rects of objects
+
+        Each object is registered, under a hashable key, in every cell its
+        rect overlaps. Point and rect queries only look at the cells they
+        touch.
+    """
+    def __init__(self, cell_size = CELL_SIZE):
+        self.cell_size = cell_size
+        # (cell x, cell y) -> set of keys
+        self.cells = {}
+        # key -> rect
+        self.rects = {}
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def cellsOf(self, rect):
+        size = self.cell_size
+        x0, y0 = rect[0] // size, rect[1] // size
+        # An empty rect still lives in the cell of its corner
+        x1 = (rect[0] + max(rect[2], 1) - 1) // size
+        y1 = (rect[1] + max(rect[3], 1) - 1) // size
+        return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+    def insert(self, key, rect):
+        rect = pygame.Rect(rect)
+        self.rects[key] = rect
+        for cell in self.cellsOf(rect):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        rect = self.rects.pop(key, None)
+        if rect is None:
+            return
+        for cell in self.cellsOf(rect):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def move(self, key, rect):
+        """ Updates the rect of a key, touching only the cells that changed """
+        old = self.rects.get(key)
+        rect = pygame.Rect(rect)
+        if old is None:
+            self.insert(key, rect)
+            return
+        old_cells = self.cellsOf(old)
+        new_cells = self.cellsOf(rect)
+        self.rects[key] = rect
+        if old_cells == new_cells:
+            return
+        for cell in set(old_cells) - set(new_cells):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+        for cell in set(new_cells) - set(old_cells):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def queryPoint(self, pos):
+        """ Keys whose rect contains pos """
+        size = self.cell_size
+        keys = self.cells.get((pos[0] // size, pos[1] // size), ())
+        return [key for key in keys if self.rects[key].collidepoint(pos)]
+
+    def queryRect(self, rect):
+        """ Keys whose rect overlaps rect """
+        rect = pygame.Rect(rect)
+        cells = self.cellsOf(rect)
+        if len(cells) > len(self.rects):
+            # Looking at every object is cheaper than looking at every cell
+            return [key for key, other in self.rects.items() if other.colliderect(rect)]
+        found = set()
+        for cell in cells:
+            found.update(self.cells.get(cell, ()))
+        return [key for key in found if self.rects[key].colliderect(rect)]
+
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
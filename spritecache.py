@@ -0,0 +1,209 @@
+import os
+import time
+from collections import OrderedDict
+
+import pygame
+
+from surfaceformat import optimizeSurface, scaleSurface, surfaceBytes, FormatStats
+
+"""
+    SpriteCache
+
+    SpriteCache fait partie de la suite logicielle FreeGameTools, il garde
+    en mémoire les sprites déjà décodés et redimensionnés pour ne pas relire
+    les fichiers PNG à chaque image.
+
+    SpriteCache is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+# Default memory budget of a cache, in bytes
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+# Minimum delay between two checks of the same file on disk, in seconds
+CHECK_INTERVAL = 1.0
+
+class SpriteCache:
+    """
+        LRU cache of decoded sprites, keyed by (sprite name, scale, file mtime)
+
+        The oldest entries are evicted once the pixels stored go over the
+        memory budget. An entry is dropped as soon as its file is seen with
+        another mtime on disk.
+        The scaled sprites are made from the sprite at scale 1, which is kept
+        in the cache too: changing the scale never decodes the file again.
+        With trim, the transparent borders of the sprites are cut when they are
+        loaded, trimOf tells where the part kept was in the whole sprite.
+        Each sprite is then stored in the cheapest format showing it as it is:
+        RLE colorkey when its pixels are either opaque or transparent, 8 bits
+        palette when it has few colors and palette is set.
+    """
+    def __init__(self, budget = DEFAULT_BUDGET, check_interval = CHECK_INTERVAL, trim = True, palette = False):
+        self.budget = budget
+        self.check_interval = check_interval
+        self.trim = trim
+        self.palette = palette
+        # Memory saved by the formats chosen for the sprites
+        self.formats = FormatStats()
+        # (name, scale, mtime) -> (offset of the trimmed sprite, size of the whole sprite)
+        self.trims = {}
+        # directory -> {sprite name: (pixels of the whole sprite, pixels kept by the trim)}
+        self.trim_stats = {}
+        # (name, scale, mtime) -> surface, the least recently used first
+        self.entries = OrderedDict()
+        # (name, scale, mtime) -> mask of the opaque pixels, built on demand
+        self.masks = {}
+        # (name, scale) -> key of the entry currently stored
+        self.current = {}
+        # path -> (mtime, time of the last check)
+        self.mtimes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Number of entries dropped because their file changed on disk
+        self.reloads = 0
+
+    def mtime(self, path):
+        """ Last modification time of path, checked at most every check_interval """
+        now = time.time()
+        known = self.mtimes.get(path)
+        if known is None or now - known[1] >= self.check_interval:
+            known = (os.path.getmtime(path), now)
+            self.mtimes[path] = known
+        return known[0]
+
+    def get(self, name, path, scale = 1, load = None):
+        """ 
+            Returns the sprite stored at path, scaled by scale, decoding it if needed
+            load(name, path) decodes the sprite, by default the file at path is read
+        """
+        key = (name, scale, self.mtime(path))
+        image = self.entries.get(key)
+        if image is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return image
+
+        self.misses += 1
+        # The file changed on disk: the old version is useless now
+        outdated = self.current.get((name, scale))
+        if outdated is not None:
+            self.drop(outdated)
+            self.reloads += 1
+
+        image, trim = self.load(name, path, scale, load)
+        self.entries[key] = image
+        self.trims[key] = trim
+        self.current[(name, scale)] = key
+        self.size += surfaceBytes(image)
+        self.shrink()
+        return image
+
+    def getMask(self, name, path, scale = 1, load = None):
+        """ Returns the mask of the pixels of the sprite which are not fully transparent """
+        image = self.get(name, path, scale, load)
+        key = self.current[(name, scale)]
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = pygame.mask.from_surface(image, 0)
+            self.masks[key] = mask
+        return mask
+
+    def trimOf(self, name, scale = 1):
+        """ 
+            Offset of the trimmed sprite in the whole sprite and size of the whole sprite
+            The sprite must have been got from the cache at this scale first
+        """
+        return self.trims[self.current[(name, scale)]]
+
+    def load(self, name, path, scale, load = None):
+        """ Returns the sprite and where it is in the whole sprite: (offset, whole size) """
+        if scale > 1:
+            image = self.get(name, path, 1, load)
+            (x, y), (width, height) = self.trimOf(name)
+            image = scaleSurface(image, (scale * image.get_width(), scale * image.get_height()))
+            return image, ((x * scale, y * scale), (width * scale, height * scale))
+        if load is None:
+            image = pygame.image.load(path).convert_alpha()
+        else:
+            image = load(name, path)
+        if self.trim:
+            image, trim = self.trimImage(image, name, path)
+        else:
+            trim = ((0, 0), image.get_size())
+        optimized, kind = optimizeSurface(image, self.palette)
+        self.formats.add(kind, image, optimized)
+        return optimized, trim
+
+    def trimImage(self, image, name, path):
+        """ Cuts the fully transparent borders of image """
+        rect = image.get_bounding_rect()
+        if rect.w == 0 or rect.h == 0: # Fully transparent: one pixel is enough
+            rect = pygame.Rect(0, 0, min(1, image.get_width()), min(1, image.get_height()))
+        stats = self.trim_stats.setdefault(os.path.dirname(path), {})
+        stats[name] = (image.get_width() * image.get_height(), rect.w * rect.h)
+        trim = (rect.topleft, image.get_size())
+        if rect.size == image.get_size():
+            return image, trim
+        trimmed = image.subsurface(rect)
+        # A sprite of a sheet stays part of its sheet, a sprite of its own file is copied to free the borders
+        if image.get_parent() is None:
+            trimmed = trimmed.copy()
+        return trimmed, trim
+
+    def trimReport(self):
+        """ Pixels cut by the trim, for each sprites directory """
+        lines = []
+        for directory, stats in sorted(self.trim_stats.items()):
+            pixels = sum(whole for whole, kept in stats.values())
+            kept = sum(kept for whole, kept in stats.values())
+            lines.append("{}: {} sprites trimmed, {} of {} pixels kept ({:.0%} cut)".format(
+                directory or ".", len(stats), kept, pixels, 1 - kept / pixels if pixels else 0))
+        return "\n".join(lines)
+
+    def drop(self, key):
+        image = self.entries.pop(key, None)
+        self.masks.pop(key, None)
+        self.trims.pop(key, None)
+        if image is not None:
+            self.size -= surfaceBytes(image)
+            if self.current.get(key[:2]) == key:
+                del self.current[key[:2]]
+
+    def shrink(self):
+        """ Evicts the least recently used entries until the budget is met """
+        # The most recent entry is always kept, even if it is bigger than the budget
+        while self.size > self.budget and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.drop(key)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.masks.clear()
+        self.trims.clear()
+        self.current.clear()
+        self.mtimes.clear()
+        self.size = 0
+
+    def stats(self):
+        return "{} sprites, {:.1f}/{:.1f} MB, {} hits, {} misses, {} evictions".format(
+            len(self.entries), self.size / 2**20, self.budget / 2**20,
+            self.hits, self.misses, self.evictions)
+
+    def formatReport(self, target = None):
+        """ Formats chosen for the sprites and the memory they saved, with their blit times on target if given """
+        return "Sprite formats: {}, {:.1f} KB saved".format(self.formats.report(target), self.formats.saved() / 1024)
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+
+"""
+    SpriteIndex
+
+    SpriteIndex fait partie de la suite logicielle FreeGameTools, il tient
+    à jour la liste des sprites d'un dossier sans avoir à le reparcourir
+    entièrement à chaque fois.
+
+    SpriteIndex is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# Minimum delay between two polls of the directories, in seconds
+POLL_INTERVAL = 1.0
+
+def isSprite(filename):
+    return filename.lower().endswith(".png")
+
+class SpriteNames:
+    """
+        Names of the sprites of a sprite source, kept sorted so that the next
+        and previous sprite are found in constant time
+    """
+    def setNames(self, names):
+        # sprite names in alphabetical order and their position in this list
+        self.names = sorted(names)
+        self.positions = dict((name, n) for n, name in enumerate(self.names))
+
+    def next(self, name, step = 1):
+        """ Sprite coming step positions after name, in alphabetical order """
+        if not self.names:
+            return None
+        n = self.positions.get(name)
+        if n is None:
+            return self.names[0]
+        return self.names[(n + step) % len(self.names)]
+
+    def previous(self, name):
+        return self.next(name, -1)
+
+class SpriteIndex(SpriteNames):
+    """
+        Index of the sprites found under a directory
+
+        Sprites are known by their file name, see SpriteNames.
+        The index is updated by looking only at the directories whose mtime
+        changed, or at the directories inotify reported when it is available.
+    """
+    def __init__(self, root, poll_interval = POLL_INTERVAL, use_inotify = True):
+        self.root = root
+        self.poll_interval = poll_interval
+        # directory -> [mtime, sprite files, subdirectories]
+        self.dirs = {}
+        # sprite name -> path
+        self.paths = {}
+        self.setNames([])
+        self.last_poll = 0
+        self.inotify = None
+        self.watches = {}
+        if use_inotify and inotify_simple is not None:
+            self.inotify = inotify_simple.INotify()
+        self.scanDir(self.root)
+        self.rebuild()
+
+    def scanDir(self, path):
+        """ Reads one directory and, recursively, the new subdirectories found in it """
+        try:
+            mtime = os.path.getmtime(path)
+            entries = os.listdir(path)
+        except OSError:
+            self.forgetDir(path)
+            return
+        files = []
+        subdirs = []
+        for entry in sorted(entries):
+            full = os.path.join(path, entry)
+            if os.path.isdir(full):
+                subdirs.append(full)
+            elif isSprite(entry):
+                files.append(entry)
+        old = self.dirs.get(path)
+        self.dirs[path] = [mtime, files, subdirs]
+        self.watch(path)
+        if old is not None:
+            for subdir in set(old[2]) - set(subdirs):
+                self.forgetDir(subdir)
+        for subdir in subdirs:
+            if old is None or not subdir in old[2] or not subdir in self.dirs:
+                self.scanDir(subdir)
+
+    def forgetDir(self, path):
+        old = self.dirs.pop(path, None)
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            try:
+                self.inotify.rm_watch(wd)
+            except OSError:
+                pass # The directory is already gone
+        if old is not None:
+            for subdir in old[2]:
+                self.forgetDir(subdir)
+
+    def watch(self, path):
+        if self.inotify is None or path in self.watches:
+            return
+        flags = inotify_simple.flags
+        try:
+            self.watches[path] = self.inotify.add_watch(path,
+                flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO)
+        except OSError:
+            pass # Too many watches: polling still works for this directory
+
+    def rebuild(self):
+        """ Rebuilds the name tables from the directories """
+        self.paths = {}
+        for path in sorted(self.dirs):
+            for filename in self.dirs[path][1]:
+                self.paths.setdefault(filename, os.path.join(path, filename))
+        self.setNames(self.paths)
+
+    def poll(self, force = False):
+        """
+            Updates the index with the directories that changed on disk
+            Returns True if the sprites list changed
+        """
+        now = time.time()
+        if not force and now - self.last_poll < self.poll_interval:
+            return False
+        self.last_poll = now
+
+        if self.inotify is not None and not force:
+            changed = set()
+            paths = dict((wd, path) for path, wd in self.watches.items())
+            for event in self.inotify.read(timeout = 0):
+                if event.wd in paths:
+                    changed.add(paths[event.wd])
+            unwatched = [path for path in self.dirs if not path in self.watches]
+            changed.update(path for path in unwatched if self.dirChanged(path))
+        else:
+            changed = [path for path in list(self.dirs) if self.dirChanged(path)]
+            if not self.root in self.dirs:
+                changed.append(self.root)
+
+        for path in changed:
+            self.scanDir(path)
+        if changed:
+            self.rebuild()
+        return bool(changed)
+
+    def dirChanged(self, path):
+        try:
+            return os.path.getmtime(path) != self.dirs[path][0]
+        except OSError:
+            return True
+
+    def find(self, name):
+        """ Path of the sprite, or None if there is no such sprite """
+        return self.paths.get(name)
+
+    def loadImage(self, name, path):
+        """ Decodes the sprite stored at path """
+        import pygame
+        return pygame.image.load(path).convert_alpha()
+
+    def snapshot(self):
+        """ Copy of the index for save, the directories entries are replaced, never changed """
+        return {"root" : self.root, "dirs" : dict(self.dirs)}
+
+    def save(self, filename, snapshot = None):
+        """ Saves a snapshot of the index, to start without scanning the sprites again """
+        from scenestore import atomicWrite
+        if snapshot is None:
+            snapshot = self.snapshot()
+        text = json.dumps(snapshot)
+        atomicWrite(filename, lambda f: f.write(text))
+
+    @classmethod
+    def load(cls, root, filename, **kwargs):
+        """
+            Creates an index from a snapshot saved by save
+            Only the directories changed since the snapshot are read again.
+            The directory is scanned normally if the snapshot is unusable.
+        """
+        try:
+            with open(filename, "r") as f:
+                snapshot = json.load(f)
+        except (IOError, ValueError):
+            snapshot = None
+        if snapshot is None or snapshot.get("root") != root:
+            return cls(root, **kwargs)
+
+        index = cls.__new__(cls)
+        index.root = root
+        index.poll_interval = kwargs.get("poll_interval", POLL_INTERVAL)
+        index.dirs = snapshot["dirs"]
+        index.last_poll = 0
+        index.inotify = None
+        index.watches = {}
+        if kwargs.get("use_inotify", True) and inotify_simple is not None:
+            index.inotify = inotify_simple.INotify()
+            for path in index.dirs:
+                index.watch(path)
+        index.rebuild()
+        index.poll(force = True)
+        return index
@@ -0,0 +1,216 @@
+import sys
+import time
+
+import pygame
+
+"""
+    SurfaceFormat
+
+    SurfaceFormat fait partie de la suite logicielle FreeGameTools, il choisit
+    pour chaque image le format le moins coûteux à afficher: couleur de
+    transparence compressée (RLE) quand les pixels sont soit opaques soit
+    transparents, palette de 256 couleurs quand l'image en a peu, et
+    transparence par pixel seulement quand elle est nécessaire.
+
+    Utilisation: python surfaceformat.py sprites_dir
+    Affiche la mémoire et le temps d'affichage gagnés sur chaque sprite.
+
+    SurfaceFormat is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2012, Léo Germond
+"""
+
+# Formats an image can be given
+ALPHA = "alpha"         # per-pixel alpha, for the images with semi-transparent pixels
+COLORKEY = "colorkey"   # transparent color, RLE compressed
+PALETTE = "palette"     # 8 bits per pixel, with a transparent color if needed
+OPAQUE = "opaque"       # display format, no transparency
+
+# Colors tried as the transparent color, the first one no pixel uses is taken
+KEY_COLORS = [(255, 0, 255), (0, 255, 255), (1, 2, 3), (254, 1, 253)]
+
+# Pixels added at once to the colors counted, which stops as soon as there are too many
+COLOR_CHUNK = 4096
+
+def surfaceBytes(surface):
+    """ Memory used by the pixels of a surface """
+    return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+def pixelsOf(surface):
+    """ Colors of the pixels of a surface without per-pixel alpha, as 32 bits integers """
+    return memoryview(pygame.image.tobytes(surface, "RGBX")).cast("I")
+
+def countColors(pixels, limit = 256):
+    """ Colors of pixels, or None as soon as there are more than limit """
+    colors = set()
+    for start in range(0, len(pixels), COLOR_CHUNK):
+        colors.update(pixels[start:start + COLOR_CHUNK])
+        if len(colors) > limit:
+            return None
+    return colors
+
+def toPalette(surface, colors, colorkey = None):
+    """ Copy of surface with 8 bits per pixel, colors are the colors of its pixels """
+    colors = sorted(colors)
+    palette = [tuple(color.to_bytes(4, sys.byteorder)[:3]) for color in colors]
+    # Not blitted: a blit to 8 bits maps the colors to a fixed palette
+    index = dict((color, n) for n, color in enumerate(colors))
+    indices = bytes(map(index.__getitem__, pixelsOf(surface)))
+    indexed = pygame.image.frombytes(indices, surface.get_size(), "P")
+    indexed.set_palette(palette)
+    if colorkey is not None:
+        indexed.set_colorkey(palette.index(tuple(colorkey)), pygame.RLEACCEL)
+    return indexed
+
+def optimizeSurface(image, palette = False):
+    """
+        Returns image in the cheapest format able to show it as it is, and the format
+        image must be converted for the display, with per-pixel alpha or not
+        With palette, the images of at most 256 colors take 8 bits per pixel,
+        which saves memory but is slower to blit than a RLE colorkey
+    """
+    width, height = image.get_size()
+    if width == 0 or height == 0:
+        return image, ALPHA if image.get_flags() & pygame.SRCALPHA else OPAQUE
+
+    if not image.get_flags() & pygame.SRCALPHA:
+        if palette and image.get_colorkey() is None:
+            colors = countColors(pixelsOf(image))
+            if colors is not None:
+                return toPalette(image, colors), PALETTE
+        return image, OPAQUE
+
+    alphas = pygame.image.tobytes(image, "RGBA")[3::4]
+    transparent = alphas.count(0)
+    if transparent + alphas.count(255) != len(alphas):
+        return image, ALPHA # Semi-transparent pixels: per-pixel alpha is needed
+    if transparent == 0:
+        return optimizeSurface(image.convert(), palette)
+
+    # Transparent pixels take a color no opaque pixel has
+    first_transparent = alphas.index(0)
+    for key in KEY_COLORS:
+        keyed = image.convert()
+        keyed.fill(key)
+        keyed.blit(image, (0, 0))
+        pixels = pixelsOf(keyed)
+        if pixels.tolist().count(pixels[first_transparent]) == transparent:
+            break
+    else:
+        return image, ALPHA # Every key color is used, very unlikely
+    colors = countColors(pixels) if palette else None
+    if colors is not None:
+        return toPalette(keyed, colors, key), PALETTE
+    keyed.set_colorkey(key, pygame.RLEACCEL)
+    return keyed, COLORKEY
+
+def indexedSurface(image):
+    """
+        8 bits copy of an image without transparency if it has at most 256 colors, None otherwise
+        The display is not needed: images can be indexed by the threads which decode them
+    """
+    colors = countColors(pixelsOf(image))
+    if colors is None:
+        return None
+    return toPalette(image, colors)
+
+def scaleSurface(image, size):
+    """ Scales image, keeping its colorkey compressed """
+    scaled = pygame.transform.scale(image, size)
+    if image.get_colorkey() is not None:
+        scaled.set_colorkey(image.get_colorkey(), pygame.RLEACCEL)
+    return scaled
+
+class FormatStats:
+    """ Memory and blit time saved by optimizeSurface, for each format chosen """
+    def __init__(self):
+        # format -> [images, bytes before, bytes after]
+        self.formats = {}
+        # format -> (image before, image after), the first one of the format, to time their blits
+        self.samples = {}
+
+    def add(self, kind, before, after):
+        stats = self.formats.setdefault(kind, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += surfaceBytes(before)
+        stats[2] += surfaceBytes(after)
+        self.samples.setdefault(kind, (before, after))
+
+    def saved(self):
+        return sum(before - after for images, before, after in self.formats.values())
+
+    def blitTimes(self, target, runs = 50):
+        """ format -> (time to blit the image before, time to blit it after), on target """
+        times = {}
+        for kind, (before, after) in self.samples.items():
+            # The image before may not be in the format of the display yet
+            before = before.convert_alpha() if before.get_flags() & pygame.SRCALPHA else before.convert()
+            times[kind] = (blitTime(before, target, runs), blitTime(after, target, runs))
+        return times
+
+    def report(self, target = None):
+        """ Memory of the images of each format, and the blit time of one of them if target is given """
+        times = {} if target is None else self.blitTimes(target)
+        parts = []
+        for kind, (images, before, after) in sorted(self.formats.items()):
+            part = "{} {} ({:.1f} -> {:.1f} KB".format(images, kind, before / 1024, after / 1024)
+            if kind in times:
+                part += ", {:.1f} -> {:.1f} us per blit".format(times[kind][0] * 1e6, times[kind][1] * 1e6)
+            parts.append(part + ")")
+        return ", ".join(parts)
+
+def blitTime(image, target, runs = 200):
+    """ Average time to blit image on target, in seconds """
+    target.blit(image, (0, 0)) # The first blit may prepare the image: not timed
+    start = time.perf_counter()
+    for n in range(runs):
+        target.blit(image, (0, 0))
+    return (time.perf_counter() - start) / runs
+
+def addPaletteOption(parser, images = "sprites"):
+    """ Adds the --palette flag of the tools, images tells what they store with a palette """
+    parser.add_argument("--palette", action = "store_true",
+        help = "store the {0} of at most 256 colors with 8 bits per pixel: less memory, slower blits".format(images))
+
+def main(args = None):
+    import argparse
+    parser = argparse.ArgumentParser(description = "Tells the memory and blit time saved on each sprite")
+    parser.add_argument("sprites", help = "directory of the sprites")
+    addPaletteOption(parser)
+    parser.add_argument("-n", "--runs", type = int, default = 200, help = "blits timed for each sprite")
+    options = parser.parse_args(args)
+
+    from headless import initHeadless
+    from spriteindex import SpriteIndex
+    initHeadless()
+    target = pygame.Surface((1024, 1024), 0, pygame.display.get_surface())
+    index = SpriteIndex(options.sprites, use_inotify = False)
+    stats = FormatStats()
+    time_before = time_after = 0
+    for name in index.names:
+        image = pygame.image.load(index.find(name)).convert_alpha()
+        optimized, kind = optimizeSurface(image, options.palette)
+        stats.add(kind, image, optimized)
+        before, after = blitTime(image, target, options.runs), blitTime(optimized, target, options.runs)
+        time_before += before
+        time_after += after
+        print("{}: {}, {} -> {} bytes, {:.1f} -> {:.1f} us per blit".format(
+            name, kind, surfaceBytes(image), surfaceBytes(optimized), before * 1e6, after * 1e6))
+    print("{} sprites: {}".format(len(index.names), stats.report()))
+    print("{:.1f} KB saved, blitting every sprite once takes {:.1f} us instead of {:.1f} us".format(
+        stats.saved() / 1024, time_after * 1e6, time_before * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())